@@ -0,0 +1,85 @@
+import os
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+# output format -> (soundfile format, subtype, extension); "wav" keeps the raw PCM file
+OUTPUT_FORMATS = {
+    "wav": None,
+    "flac": ("FLAC", "PCM_16", ".flac"),  # lossless
+    "opus": ("OGG", "OPUS", ".opus"),     # lossy, far smaller but CPU heavier
+}
+
+def encode_audio(audio, sample_rate, fmt):
+    """Encode int16 mono audio into `fmt` ("flac" or "opus") and return the bytes."""
+    import soundfile as sf  # optional dependency, only needed for compressed output
+    sf_format, subtype, _ = OUTPUT_FORMATS[fmt]
+    buf = BytesIO()
+    sf.write(buf, audio, sample_rate, format = sf_format, subtype = subtype)
+    return buf.getvalue()
+
+def read_pcm(filename):
+    """Read a 16-bit PCM WAV as (int16 samples, sample rate)."""
+    with wave.open(filename, "rb") as rf:
+        audio = np.frombuffer(rf.readframes(rf.getnframes()), dtype = np.int16)
+        return audio, rf.getframerate()
+
+class EncoderPool:
+    """Re-encodes finished WAV files to FLAC/Opus on a pool of encoder threads.
+
+    libsndfile releases the GIL while encoding, so the pool runs in parallel with
+    the audio callback. Encoded bytes are handed to the I/O worker, which writes
+    the compressed file and removes the WAV, so all filesystem writes still go
+    through it.
+    """
+
+    def __init__(self, fmt, io, workers = 2):
+        if OUTPUT_FORMATS.get(fmt) is None:
+            raise ValueError(f"unsupported compressed format: {fmt!r}")
+        encode_audio(np.zeros(160, dtype = np.int16), 16000, fmt)  # fail fast if soundfile is missing
+        self.fmt = fmt
+        self.extension = OUTPUT_FORMATS[fmt][2]
+        self._io = io
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = f"{fmt}-encoder")
+
+    def submit(self, wav_path, on_done = None):
+        """Encode `wav_path`; `on_done(out_path, stats, error)` fires once the file is written."""
+        self._pool.submit(self._encode, wav_path, on_done)
+
+    def shutdown(self):
+        """Wait for queued encodes; their writes are then queued on the I/O worker."""
+        self._pool.shutdown(wait = True)
+
+    def _encode(self, wav_path, on_done):
+        out_path = os.path.splitext(wav_path)[0] + self.extension
+        try:
+            t0 = time.perf_counter()
+            audio, sample_rate = read_pcm(wav_path)
+            data = encode_audio(audio, sample_rate, self.fmt)
+            stats = {
+                "format": self.fmt,
+                "pcm_bytes": audio.nbytes,
+                "encoded_bytes": len(data),
+                "encode_ms": (time.perf_counter() - t0) * 1000.0,
+            }
+        except Exception as e:
+            print(f"⚠️ Encoding {wav_path} to {self.fmt} failed:", e)
+            if on_done is not None:
+                on_done(wav_path, None, e)
+            return
+
+        def _on_written(error):
+            if on_done is not None:
+                on_done(out_path, stats, error)
+        self._io.submit(self._write, out_path, data, wav_path, on_done = _on_written, droppable = False)
+
+    @staticmethod
+    def _write(out_path, data, wav_path):
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+        os.remove(wav_path)
\ No newline at end of file
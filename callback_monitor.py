@@ -0,0 +1,195 @@
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+class CallbackMonitor:
+    """Times every audio callback against its deadline and explains the overruns.
+
+    The callback calls `begin(status)`, then `phase(name)` whenever it moves
+    on to another kind of work ("vad", "write", "close_segment", ...), and
+    `end(frames)`, whose budget is `frames / sample_rate` (the time until the
+    next block is due). A few hundred nanoseconds per call, nothing is
+    formatted in the callback.
+
+    Each overrun is recorded with the time spent per phase, and so is each
+    `input overflow` flag, together with how late the callback started; an
+    overflow without an overrun before it points outside the callback (GIL
+    held by another thread, scheduling). A reporter thread prints new
+    records every `report_interval` seconds. The last `window` durations
+    form the rolling histogram in `stats()`; the `keep_worst` longest
+    overruns are kept for `dump()`.
+
+    With `profile = True` a sampler thread records the callback thread's
+    stack every `sample_interval` seconds while a callback runs, and
+    overruns keep their samples as folded stacks (flamegraph.pl /
+    speedscope format). The sampler needs the GIL, so while the callback runs
+    Python code it gets a sample at most every switch interval (5 ms by
+    default, see sys.setswitchinterval); each sample also takes the GIL from
+    the callback for a moment, so this is meant for diagnosis, not production.
+    """
+
+    def __init__(self, sample_rate, window = 2000, keep_worst = 20, report_interval = 1.0,
+                 profile = False, sample_interval = 0.001):
+        self.sample_rate = sample_rate
+        self.keep_worst = keep_worst
+        self.callbacks = 0
+        self.overruns = 0
+        self.overflows = 0
+        self.max_s = 0.0
+        self._durations = np.zeros(window)
+        self._phases = []
+        self._phase = "callback"
+        self._phase_start = 0.0
+        self._start = None  # perf_counter of the running callback, None between callbacks
+        self._last_start = None
+        self._last_budget = 0.0
+        self._last_overrun = False
+        self._status = None
+        self._worst = []  # min-heap of (duration, n, record)
+        self._new = deque()  # records not printed yet
+        self._samples = []
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._reporter = threading.Thread(target = self._report_loop, args = (report_interval,),
+                                          name = "callback-monitor", daemon = True)
+        self._reporter.start()
+        self.profile = profile
+        if profile:
+            self._sampler = threading.Thread(target = self._sample_loop, args = (sample_interval,),
+                                             name = "callback-sampler", daemon = True)
+            self._sampler.start()
+
+    def begin(self, status = None):
+        now = time.perf_counter()
+        self._start = self._phase_start = now
+        self._phase = "callback"
+        self._phases = []
+        self._samples = []
+        self._thread_id = threading.get_ident()
+        if status:
+            self.overflows += 1
+            self._status = str(status)
+            late = now - self._last_start - self._last_budget if self._last_start is not None else 0.0
+            self._new.append({
+                "type": "status",
+                "time": time.time(),
+                "status": self._status,
+                "late_ms": late * 1000.0,
+                "after_overrun": self._last_overrun,
+            })
+        else:
+            self._status = None
+        self._last_start = now
+        return now
+
+    def phase(self, name):
+        """The callback moves on to `name`; time since the last phase goes to the previous one."""
+        now = time.perf_counter()
+        self._phases.append((self._phase, now - self._phase_start))
+        self._phase, self._phase_start = name, now
+
+    def end(self, frames):
+        """Close the callback; returns its duration in seconds."""
+        now = time.perf_counter()
+        duration = now - self._start
+        budget = frames / self.sample_rate
+        self._start = None
+        self._durations[self.callbacks % len(self._durations)] = duration
+        self.callbacks += 1
+        self.max_s = max(self.max_s, duration)
+        self._last_budget = budget
+        self._last_overrun = duration > budget
+        if duration > budget:
+            self.overruns += 1
+            self._phases.append((self._phase, now - self._phase_start))
+            phases = Counter()
+            for name, seconds in self._phases:
+                phases[name] += seconds * 1000.0
+            record = {
+                "type": "overrun",
+                "time": time.time(),
+                "duration_ms": duration * 1000.0,
+                "budget_ms": budget * 1000.0,
+                "phases_ms": dict(phases.most_common()),
+                "status": self._status,
+            }
+            if self.profile:
+                record["stacks"] = dict(Counter(self._samples).most_common())
+            self._new.append(record)
+            entry = (duration, self.overruns, record)
+            if len(self._worst) < self.keep_worst:
+                heapq.heappush(self._worst, entry)
+            elif duration > self._worst[0][0]:
+                heapq.heapreplace(self._worst, entry)
+        return duration
+
+    def stats(self):
+        n = min(self.callbacks, len(self._durations))
+        recent = self._durations[:n] * 1000.0 if n else np.zeros(1)
+        return {
+            "callbacks": self.callbacks,
+            "overruns": self.overruns,
+            "overflows": self.overflows,
+            "p50_ms": round(float(np.percentile(recent, 50)), 3),
+            "p99_ms": round(float(np.percentile(recent, 99)), 3),
+            "max_recent_ms": round(float(recent.max()), 3),
+            "max_ms": round(self.max_s * 1000.0, 3),
+        }
+
+    def worst(self):
+        """The longest overruns, longest first."""
+        return [record for _, _, record in sorted(self._worst, reverse = True)]
+
+    def dump(self, path):
+        """Write the worst overruns to `path` (JSON) and, when profiling, their merged stacks to `path`.folded."""
+        worst = self.worst()
+        with open(path, "w") as f:
+            json.dump({"stats": self.stats(), "worst": worst}, f, indent = 4)
+        if self.profile:
+            stacks = Counter()
+            for record in worst:
+                stacks.update(record.get("stacks", {}))
+            with open(os.path.splitext(path)[0] + ".folded", "w") as f:
+                for stack, n in stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+
+    def stop(self):
+        self._stopped.set()
+        self._reporter.join(timeout = 2)
+        self._print_new()
+
+    def _report_loop(self, interval):
+        while not self._stopped.wait(interval):
+            self._print_new()
+
+    def _print_new(self):
+        while self._new:
+            record = self._new.popleft()
+            if record["type"] == "overrun":
+                phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in record["phases_ms"].items())
+                print(f"⏱️ Callback overrun: {record['duration_ms']:.1f} ms > {record['budget_ms']:.1f} ms ({phases})")
+            elif record["after_overrun"]:
+                print(f"⚠️ {record['status']} after a callback overrun")
+            else:
+                # the callback kept its budget, so the time went elsewhere before it was called
+                print(f"⚠️ {record['status']} without a callback overrun: this callback started "
+                      f"{record['late_ms']:.1f} ms late (GIL held by another thread, or scheduling)")
+
+    def _sample_loop(self, interval):
+        while not self._stopped.is_set():
+            time.sleep(interval)
+            if self._start is None:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self._samples.append(";".join(reversed(stack)))
@@ -0,0 +1,60 @@
+import threading
+import time
+
+class DeadlineTimer:
+    """Single-shot deadline that runs `callback` from a worker thread.
+
+    `arm(delay)` (re)schedules the deadline and `cancel()` disarms it. Only one
+    deadline is pending at a time, so re-arming replaces the previous one.
+    The worker sleeps on a condition variable, so an idle timer costs no wakeups.
+    """
+
+    def __init__(self, callback, name = "deadline-timer"):
+        self._callback = callback
+        self._cond = threading.Condition()
+        self._deadline = None
+        self._stopped = False
+        self._thread = threading.Thread(target = self._run, name = name, daemon = True)
+        self._thread.start()
+
+    def arm(self, delay):
+        with self._cond:
+            self._deadline = time.monotonic() + delay
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self._deadline = None
+            self._cond.notify()
+
+    def stop(self, timeout = 2):
+        with self._cond:
+            self._stopped = True
+            self._deadline = None
+            self._cond.notify()
+        self._thread.join(timeout = timeout)
+
+    @property
+    def armed(self):
+        with self._cond:
+            return self._deadline is not None
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._deadline = None
+                # run the callback unlocked so it may re-arm / cancel the timer
+                self._cond.release()
+                try:
+                    self._callback()
+                except Exception as e:
+                    print("⚠️ Deadline callback failed:", e)
+                finally:
+                    self._cond.acquire()
\ No newline at end of file
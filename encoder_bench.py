@@ -0,0 +1,60 @@
+"""Encoder throughput benchmark for sizing ENCODER_WORKERS per node.
+
+    python encoder_bench.py                         # synthetic 10s clips
+    python encoder_bench.py recordings/*.wav        # real segments
+    python encoder_bench.py --formats flac --workers 1 2 4 8 --clips 64
+
+"x realtime" is seconds of audio encoded per wall-clock second, i.e. how many
+live streams one node can keep up with at that pool size.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_encoder import OUTPUT_FORMATS, encode_audio, read_pcm
+from synthetic_audio import synthetic_clip
+
+SAMPLE_RATE = 16000
+
+def run(clips, fmt, workers):
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        sizes = list(pool.map(lambda clip: len(encode_audio(clip, SAMPLE_RATE, fmt)), clips))
+    wall = time.perf_counter() - t0
+    audio_seconds = sum(len(c) for c in clips) / SAMPLE_RATE
+    pcm_bytes = sum(c.nbytes for c in clips)
+    return {
+        "format": fmt,
+        "workers": workers,
+        "wall_s": wall,
+        "x_realtime": audio_seconds / wall,
+        "ratio": pcm_bytes / max(1, sum(sizes)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs = "*", help = "16 kHz mono WAVs (default: synthetic clips)")
+    parser.add_argument("--formats", nargs = "+", default = ["flac", "opus"],
+                        choices = [f for f, spec in OUTPUT_FORMATS.items() if spec])
+    parser.add_argument("--workers", nargs = "+", type = int, default = [1, 2, 4])
+    parser.add_argument("--clips", type = int, default = 32, help = "synthetic clips per run")
+    parser.add_argument("--seconds", type = float, default = 10.0, help = "length of each synthetic clip")
+    args = parser.parse_args()
+
+    if args.files:
+        clips = [read_pcm(f)[0] for f in args.files]
+    else:
+        clips = [synthetic_clip(args.seconds, i) for i in range(args.clips)]
+    total = sum(len(c) for c in clips) / SAMPLE_RATE
+    print(f"🎧 {len(clips)} clips, {total:.1f}s of audio")
+
+    print(f"{'format':<8}{'workers':>8}{'wall s':>10}{'x realtime':>12}{'ratio':>8}")
+    for fmt in args.formats:
+        encode_audio(clips[0][:SAMPLE_RATE], SAMPLE_RATE, fmt)  # warm up the codec
+        for workers in args.workers:
+            r = run(clips, fmt, workers)
+            print(f"{r['format']:<8}{r['workers']:>8}{r['wall_s']:>10.2f}"
+                  f"{r['x_realtime']:>12.1f}{r['ratio']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import deque
+
+class IOWorker:
+    """Single background thread that owns the filesystem writes of the pipeline.
+
+    Jobs run in submission order. `submit()` never blocks: once `maxsize` jobs
+    are waiting, droppable jobs (bulk audio frames) are dropped and counted, so
+    a stalled disk can never back up into audio capture. Control jobs (open,
+    close, sync, rename) pass `droppable = False` and are always queued.
+
+    `on_done(error)` is called from the worker thread after the job ran, with
+    None on success or the exception it raised.
+    """
+
+    def __init__(self, maxsize = 2048, name = "io-worker"):
+        self.maxsize = maxsize
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._completed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._max_depth = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._thread = threading.Thread(target = self._run, name = name, daemon = True)
+        self._thread.start()
+
+    def submit(self, fn, *args, on_done = None, droppable = True):
+        """Queue `fn(*args)`; returns False if the job was dropped."""
+        with self._cond:
+            if self._stopped or (droppable and len(self._jobs) >= self.maxsize):
+                self._dropped += 1
+                if self._dropped == 1 or self._dropped % 100 == 0:
+                    print(f"⚠️ I/O queue full, dropped {self._dropped} job(s)")
+                return False
+            self._jobs.append((fn, args, on_done, time.perf_counter()))
+            self._max_depth = max(self._max_depth, len(self._jobs))
+            self._cond.notify()
+        return True
+
+    def flush(self, timeout = None):
+        """Block until every job submitted so far has run."""
+        done = threading.Event()
+        if not self.submit(done.set, droppable = False):
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout = 5):
+        """Run the remaining jobs, then stop the thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout = timeout)
+
+    def stats(self):
+        """Queue depth and enqueue-to-completion latency of the jobs run so far."""
+        with self._cond:
+            done = self._completed + self._failed
+            return {
+                "queue_depth": len(self._jobs),
+                "max_queue_depth": self._max_depth,
+                "completed": self._completed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "latency_ms_avg": self._latency_total / done * 1000.0 if done else 0.0,
+                "latency_ms_max": self._latency_max * 1000.0,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._stopped:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                fn, args, on_done, queued_at = self._jobs.popleft()
+            error = None
+            try:
+                fn(*args)
+            except Exception as e:
+                error = e
+                print(f"⚠️ I/O job {getattr(fn, '__name__', fn)} failed:", e)
+            latency = time.perf_counter() - queued_at
+            with self._cond:
+                if error is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+            if on_done is not None:
+                try:
+                    on_done(error)
+                except Exception as e:
+                    print("⚠️ I/O completion callback failed:", e)
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""In-process metrics, served in the Prometheus text format.
+
+    import metrics
+    frames = metrics.counter("vad_frames_total", "Audio frames run through TEN-VAD")
+    frames.inc()
+    metrics.serve(9464)      # curl http://localhost:9464/metrics
+
+Updating a metric is a few attribute operations, cheap enough for the audio
+callback; nothing is formatted until a scrape. Updates take no lock, so
+each metric should be updated from one thread (the audio callback, the I/O
+thread, ...); with several writers a racing update can lose an increment.
+Metrics created with `fn` read their value from it at scrape time, which
+exposes counters a component keeps anyway at no cost.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds: 100 us (a VAD call) to 10 s (a merge window and its I/O)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames = (), fn = None, labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._label_values = labels
+        self._children = {}
+        self._lock = threading.Lock()  # only guards creating children
+
+    def labels(self, *values):
+        """The child metric for one combination of label values (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._child(values)
+        return child
+
+    def _child(self, values):
+        return type(self)(self.name, self.help, labels = tuple(zip(self.labelnames, values)))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.labelnames:
+            for child in list(self._children.values()):
+                lines += child._samples()
+        else:
+            lines += self._samples()
+        return lines
+
+    def _label_text(self, extra = ()):
+        pairs = self._label_values + tuple(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0
+
+    def inc(self, n = 1):
+        self.value += n
+
+    def _samples(self):
+        return [f"{self.name}{self._label_text()} {self.fn() if self.fn else self.value}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames = (), buckets = LATENCY_BUCKETS, labels = ()):
+        super().__init__(name, help, labelnames, labels = labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _child(self, values):
+        return Histogram(self.name, self.help, buckets = self.buckets, labels = tuple(zip(self.labelnames, values)))
+
+    def _samples(self):
+        lines = []
+        total = 0
+        for bound, n in zip(self.buckets + ("+Inf",), list(self.counts)):
+            total += n
+            lines.append(f"{self.name}_bucket{self._label_text((('le', bound),))} {total}")
+        lines.append(f"{self.name}_sum{self._label_text()} {self.sum}")
+        lines.append(f"{self.name}_count{self._label_text()} {total}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, cls, name, *args, **kwargs):
+        """The metric called `name`, created on first use so modules can share it."""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help, labelnames = (), fn = None):
+    return REGISTRY.register(Counter, name, help, labelnames, fn = fn)
+
+def gauge(name, help, labelnames = (), fn = None):
+    return REGISTRY.register(Gauge, name, help, labelnames, fn = fn)
+
+def histogram(name, help, labelnames = (), buckets = LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram, name, help, labelnames, buckets = buckets)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+def serve(port, host = "localhost"):
+    """Serve REGISTRY at http://host:port/metrics from a daemon thread; returns the server (None if the port is taken)."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"⚠️ Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = "metrics-http", daemon = True).start()
+    print(f"📈 Metrics at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,482 @@
+"""Replay a WAV file through a realtime script, with no audio hardware.
+
+    python replay.py ten_vad_segmentation.py speech.wav                  # as fast as possible
+    python replay.py smart-turn-detection/vad.py speech.wav --speed 1 --blocksize 512 --jitter 0.005
+    python replay.py smart-turn-detection/record_and_predict.py speech.wav --speed 4
+    python replay.py ten_vad_segmentation.py --synthetic 300 --blocksize 128,256,1024 --out replay_results/base
+    python replay.py --compare replay_results/base replay_results/new --max-regression 20
+
+The script is loaded as a module (so its `__main__` block does not run) with
+stand-ins for `sounddevice` and `pyaudio`. Its `audio_callback` gets the
+file's audio in blocks of `--blocksize` frames, or its PyAudio loop reads
+them from `stream.read()`. When the file ends the script shuts down the way
+it does on Ctrl+C. A trailing partial block is not delivered, as with a real
+stream.
+
+Time in the script follows the audio, not the wall clock: its `time.time()`
+advances by each block's duration before the block is delivered, and its
+merge-window DeadlineTimer is replaced by one on the same clock, fired
+between blocks. Silence timeouts, merges and timestamps therefore come out
+the same at any `--speed` (0: as fast as possible; 1: real time; 4: four
+times real time) and with any `--jitter` (up to that many seconds of random
+delay per block, which only stresses the script's own threads). `perf_counter`
+and `monotonic` stay real, so callback timings and traces measure the
+machine.
+
+Everything the script writes (recordings/, merged/, timestamps.json,
+segments.db, ...) goes to `--out` (default replay_results/<script>_<time>/),
+its console output to console.log there. Events are recorded instead of
+published (`--publish` also sends them to the script's configured
+WebSocket or shared-memory transport), and so are Smart Turn predictions.
+replay.json holds the events, the output files' hashes and the timings: time
+per callback (or per chunk between `stream.read()` calls) against the
+block's real-time budget, how late blocks were delivered when paced, and
+the overall x realtime. `--compare A B` diffs two runs and exits 1 when
+their events or files differ, or when p99 callback time regressed by more
+than `--max-regression` percent.
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+import wave
+from collections import Counter, namedtuple
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from deadline_timer import DeadlineTimer
+from synthetic_audio import speech_stream
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".flac", ".opus")
+
+# the `time` argument of a sounddevice callback; an ADC time of 0 means unknown
+StreamTime = namedtuple("StreamTime", "inputBufferAdcTime currentTime outputBufferDacTime")
+
+class VirtualClock:
+    """Stands in for a replayed script's `time` module: `time()` follows the audio delivered so far."""
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.elapsed = 0.0  # seconds of audio delivered
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def time(self):
+        return self.epoch + self.elapsed
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class VirtualTimer:
+    """DeadlineTimer on a VirtualClock; the replay loop calls `poll()` between blocks."""
+
+    def __init__(self, callback, clock):
+        self._callback = callback
+        self._clock = clock
+        self._deadline = None
+
+    def arm(self, delay):
+        self._deadline = self._clock.time() + delay
+
+    def cancel(self):
+        self._deadline = None
+
+    def stop(self, timeout = 2):
+        self._deadline = None
+
+    @property
+    def armed(self):
+        return self._deadline is not None
+
+    def poll(self):
+        if self._deadline is None or self._clock.time() < self._deadline:
+            return
+        self._deadline = None
+        try:
+            self._callback()
+        except Exception as e:
+            print("⚠️ Deadline callback failed:", e)
+
+class Pacer:
+    """Holds each block back until its audio would have been captured at `speed` x real time."""
+
+    def __init__(self, speed, jitter = 0.0, seed = 0):
+        self.speed = speed
+        self.jitter = jitter
+        self._rng = np.random.default_rng(seed)
+        self._start = None
+
+    def wait(self, audio_seconds):
+        """Sleep until `audio_seconds` of audio are due; returns how late the block is, in seconds."""
+        if not self.speed:
+            return 0.0
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now - audio_seconds / self.speed  # the first block is due now
+        due = self._start + audio_seconds / self.speed
+        target = due + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if target > now:
+            time.sleep(target - now)
+            now = time.perf_counter()
+        return max(0.0, now - due)
+
+class Timings:
+    """Time per callback (or per chunk read) against the block's real-time budget."""
+
+    def __init__(self):
+        self.durations = []
+        self.lags = []
+        self.over_budget = 0
+
+    def add(self, duration, budget, lag):
+        self.durations.append(duration)
+        self.lags.append(lag)
+        if duration > budget:
+            self.over_budget += 1
+
+    def summary(self):
+        d = np.array(self.durations or [0.0]) * 1000.0
+        lags = np.array(self.lags or [0.0]) * 1000.0
+        return {
+            "count": len(self.durations),
+            "p50_ms": float(np.percentile(d, 50)),
+            "p90_ms": float(np.percentile(d, 90)),
+            "p99_ms": float(np.percentile(d, 99)),
+            "max_ms": float(d.max()),
+            "over_budget": self.over_budget,
+            "lag_p99_ms": float(np.percentile(lags, 99)),
+            "lag_max_ms": float(lags.max()),
+        }
+
+class RecordingPublisher:
+    """Takes the place of a script's publisher and records what it publishes, at audio time."""
+
+    def __init__(self, clock, forward = None):
+        self.clock = clock
+        self.forward = forward
+        self.events = []
+        self.audio_frames = 0
+        self.audio_samples = 0
+        self.sent_events = 0
+
+    def publish(self, event_type, payload, key = None, trace = None):
+        self.record(event_type, payload)
+        if self.forward is not None:
+            self.forward.publish(event_type, payload, key = key, trace = trace)
+        return True
+
+    def publish_audio(self, segment, offset, samples):
+        self.audio_frames += 1
+        self.audio_samples += len(samples)
+        if self.forward is not None:
+            self.forward.publish_audio(segment, offset, samples)
+        return True
+
+    def record(self, event_type, payload):
+        self.events.append({"t": round(self.clock.elapsed, 4), "event": event_type, "data": payload})
+        self.sent_events += 1
+
+    def pending(self):
+        return self.forward.pending() if self.forward is not None else 0
+
+    def stats(self):
+        stats = {"recorded_events": len(self.events), "audio_frames": self.audio_frames}
+        if self.forward is not None:
+            stats["forwarded"] = self.forward.stats()
+        return stats
+
+    def stop(self, timeout = 2):
+        if self.forward is not None:
+            self.forward.stop(timeout = timeout)
+
+def sounddevice_stub():
+    sd = types.ModuleType("sounddevice")
+
+    class CallbackStop(Exception):
+        pass
+
+    class CallbackAbort(Exception):
+        pass
+
+    def InputStream(*args, **kwargs):
+        raise RuntimeError("no audio device during a replay; the replay calls audio_callback itself")
+
+    sd.CallbackStop, sd.CallbackAbort, sd.InputStream = CallbackStop, CallbackAbort, InputStream
+    return sd
+
+class _ReplayPyAudioStream:
+    """What `PyAudio().open()` returns: `read()` hands out the replayed audio, paced."""
+
+    def __init__(self, audio, clock, pacer, timings):
+        self._audio = audio
+        self._clock = clock
+        self._pacer = pacer
+        self._timings = timings
+        self._pos = 0
+        self._returned = None
+        self._lag = 0.0
+        self.stops = 0
+
+    def read(self, num_frames, exception_on_overflow = True):
+        if self._returned is not None:
+            # everything the loop did with the last chunk
+            self._timings.add(time.perf_counter() - self._returned, num_frames / SAMPLE_RATE, self._lag)
+        if self._pos + num_frames > len(self._audio):
+            raise KeyboardInterrupt  # end of the file: stop the way Ctrl+C does
+        chunk = self._audio[self._pos:self._pos + num_frames]
+        self._pos += num_frames
+        self._clock.advance(num_frames / SAMPLE_RATE)
+        self._lag = self._pacer.wait(self._clock.elapsed)
+        self._returned = time.perf_counter()
+        return chunk.tobytes()
+
+    def stop_stream(self):
+        self.stops += 1
+        self._returned = None  # the loop is not reading while the stream is stopped
+
+    def start_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+def pyaudio_stub(stream):
+    pa = types.ModuleType("pyaudio")
+    pa.paInt16 = 8
+
+    class PyAudio:
+        def open(self, **kwargs):
+            return stream
+
+        def terminate(self):
+            pass
+
+    pa.PyAudio = PyAudio
+    return pa
+
+def load_audio(path):
+    """A 16 kHz mono 16-bit WAV as int16 samples (the first channel of a multichannel file)."""
+    with wave.open(path, "rb") as rf:
+        if rf.getframerate() != SAMPLE_RATE or rf.getsampwidth() != 2:
+            raise ValueError(f"{path}: need {SAMPLE_RATE} Hz 16-bit PCM, got {rf.getframerate()} Hz "
+                             f"{8 * rf.getsampwidth()}-bit")
+        audio = np.frombuffer(rf.readframes(rf.getnframes()), dtype = np.int16)
+        return audio[::rf.getnchannels()].copy()
+
+def load_script(path):
+    """Import the script at `path` as a module; its `if __name__ == "__main__"` block does not run."""
+    name = "replayed_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def virtualize(module, clock, recorder):
+    """Put the script's wall clock, merge timers, publisher and Smart Turn calls on the replay."""
+    module.time = clock
+    if hasattr(module, "start_time"):
+        module.start_time = clock.epoch
+    timers = []
+    for name, value in list(vars(module).items()):
+        if isinstance(value, DeadlineTimer):
+            value.stop()
+            timer = VirtualTimer(value._callback, clock)
+            setattr(module, name, timer)
+            timers.append(timer)
+    if hasattr(module, "_publisher"):
+        if recorder.forward is None:
+            module._publisher.stop(timeout = 0.5)
+        module._publisher = recorder
+    predict_endpoint = getattr(module, "predict_endpoint", None)
+    if predict_endpoint is not None:
+        def recorded_predict_endpoint(*args, **kwargs):
+            result = predict_endpoint(*args, **kwargs)
+            recorder.record("smart_turn", {"prediction": int(result.get("prediction", 0)),
+                                           "probability": float(result.get("probability", float("nan")))})
+            return result
+        module.predict_endpoint = recorded_predict_endpoint
+    return timers
+
+def drive_callback(module, audio, blocksizes, pacer, clock, timers, timings, seed = 0):
+    """Deliver `audio` to `module.audio_callback` block by block, the way an sd.InputStream would."""
+    sd = sys.modules["sounddevice"]
+    rng = np.random.default_rng(seed)
+    stream_time = StreamTime(0.0, 0.0, 0.0)
+    pos = 0
+    while True:
+        frames = blocksizes[0] if len(blocksizes) == 1 else int(rng.choice(blocksizes))
+        if pos + frames > len(audio):
+            break
+        # sounddevice hands int16 devices' samples over as float32 in [-1, 1)
+        indata = (audio[pos:pos + frames].astype(np.float32) / 32768.0).reshape(-1, 1)
+        pos += frames
+        clock.advance(frames / SAMPLE_RATE)
+        lag = pacer.wait(clock.elapsed)
+        started = time.perf_counter()
+        try:
+            module.audio_callback(indata, frames, stream_time, None)
+        except (sd.CallbackStop, sd.CallbackAbort):
+            break
+        finally:
+            timings.add(time.perf_counter() - started, frames / SAMPLE_RATE, lag)
+        for timer in timers:
+            timer.poll()
+
+def hash_outputs(root):
+    """sha256 and size of every audio file the script wrote under `root`."""
+    files = {}
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            if not name.endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            files[os.path.relpath(path, root)] = {"bytes": os.path.getsize(path), "sha256": digest}
+    return files
+
+def replay(args):
+    script = os.path.abspath(args.script)
+    if args.wav:
+        audio = load_audio(args.wav)
+    else:
+        audio = speech_stream(args.synthetic, args.seed)[:int(args.synthetic * SAMPLE_RATE)]
+    blocksizes = [int(b) for b in str(args.blocksize).split(",")] if args.blocksize else None
+    out = os.path.abspath(args.out or os.path.join(
+        "replay_results", f"{os.path.splitext(os.path.basename(script))[0]}_{time.strftime('%Y%m%d_%H%M%S')}"))
+    os.makedirs(out, exist_ok = True)
+
+    clock = VirtualClock(round(time.time()))
+    pacer = Pacer(args.speed, args.jitter, args.seed)
+    timings = Timings()
+    stream = _ReplayPyAudioStream(audio, clock, pacer, timings)
+    sys.modules["sounddevice"] = sounddevice_stub()
+    sys.modules["pyaudio"] = pyaudio_stub(stream)
+    sys.path.insert(0, os.path.dirname(script))  # the script's own imports (inference, ...)
+
+    print(f"▶️ Replaying {args.wav or f'{args.synthetic:.0f} s of synthetic speech'} "
+          f"({len(audio) / SAMPLE_RATE:.1f} s) through {args.script} at "
+          f"{f'{args.speed:g}x' if args.speed else 'full speed'} → {out}/")
+    cwd = os.getcwd()
+    os.chdir(out)  # the script writes recordings/, merged/, ... relative to the working directory
+    console = sys.stdout if args.console else open("console.log", "w")
+    try:
+        with redirect_stdout(console):
+            module = load_script(script)
+            recorder = RecordingPublisher(clock, forward = getattr(module, "_publisher", None) if args.publish else None)
+            timers = virtualize(module, clock, recorder)
+            if hasattr(module, "ensure_model"):
+                # keep the downloaded model next to the script, not in every output directory
+                ensure_model = module.ensure_model
+                model = os.path.join(os.path.dirname(script), os.path.basename(module.ONNX_MODEL_PATH))
+                module.ensure_model = lambda: ensure_model(model)
+            started = time.perf_counter()
+            if hasattr(module, "audio_callback"):
+                drive_callback(module, audio, blocksizes or [module.HOP_SIZE], pacer, clock, timers, timings,
+                               args.seed)
+            elif hasattr(module, "record_and_predict"):
+                module.record_and_predict()
+            else:
+                raise SystemExit(f"{args.script} has neither audio_callback nor record_and_predict")
+            if hasattr(module, "shutdown"):
+                module.shutdown()
+            wall = time.perf_counter() - started
+    finally:
+        if console is not sys.stdout:
+            console.close()
+
+    summary = {
+        "script": args.script,
+        "input": args.wav or f"synthetic {args.synthetic:g} s, seed {args.seed}",
+        "params": {"speed": args.speed, "blocksize": args.blocksize, "jitter": args.jitter, "seed": args.seed},
+        "audio_s": clock.elapsed,
+        "wall_s": wall,
+        "x_realtime": clock.elapsed / wall if wall else 0.0,
+        "callbacks": timings.summary(),
+        "event_counts": dict(Counter(e["event"] for e in recorder.events)),
+        "audio_frames_published": recorder.audio_frames,
+        "io": module._io.stats() if hasattr(module, "_io") else None,
+        "files": hash_outputs(out),
+        "events": recorder.events,
+    }
+    with open("replay.json", "w") as f:
+        json.dump(summary, f, indent = 4, ensure_ascii = False, default = _plain)
+    os.chdir(cwd)
+
+    c = summary["callbacks"]
+    print(f"⏱️ {summary['audio_s']:.1f} s of audio in {wall:.2f} s ({summary['x_realtime']:.1f}x realtime)")
+    print(f"⏱️ {c['count']} blocks: p50 {c['p50_ms']:.3f} ms, p99 {c['p99_ms']:.3f} ms, max {c['max_ms']:.3f} ms, "
+          f"{c['over_budget']} over budget" + (f", delivered up to {c['lag_max_ms']:.1f} ms late" if args.speed else ""))
+    print(f"📨 Events: {summary['event_counts']}, {len(summary['files'])} audio files")
+    print(f"📝 Results written to {os.path.join(out, 'replay.json')}")
+
+def _plain(value):
+    # numpy scalars in payloads (probabilities, sample counts)
+    return value.item() if hasattr(value, "item") else str(value)
+
+def _canonical(events):
+    # thread interleaving may reorder events between runs, and *_ms fields are timings
+    return sorted(json.dumps({"event": e["event"], "data": {k: v for k, v in e["data"].items() if not k.endswith("_ms")}
+                                                            if isinstance(e["data"], dict) else e["data"]},
+                             sort_keys = True, default = _plain) for e in events)
+
+def compare(a_path, b_path, max_regression = None):
+    """Print how run B differs from run A; returns the exit status (1 if outputs differ or p99 regressed)."""
+    runs = []
+    for path in (a_path, b_path):
+        with open(os.path.join(path, "replay.json") if os.path.isdir(path) else path) as f:
+            runs.append(json.load(f))
+    a, b = runs
+    status = 0
+    same_events = _canonical(a["events"]) == _canonical(b["events"])
+    same_files = {k: v["sha256"] for k, v in a["files"].items()} == {k: v["sha256"] for k, v in b["files"].items()}
+    print(f"{'events':<22}{'identical' if same_events else 'DIFFER'} ({len(a['events'])} / {len(b['events'])})")
+    print(f"{'audio files':<22}{'identical' if same_files else 'DIFFER'} ({len(a['files'])} / {len(b['files'])})")
+    if not (same_events and same_files):
+        status = 1
+    print(f"\n{'':<22}{'A':>12}{'B':>12}{'change':>10}")
+    rows = [("wall s", a["wall_s"], b["wall_s"]), ("x realtime", a["x_realtime"], b["x_realtime"])]
+    rows += [(f"block {key.replace('_', ' ')}", a["callbacks"][key], b["callbacks"][key])
+             for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms", "over_budget", "lag_max_ms")]
+    for name, x, y in rows:
+        change = f"{(y - x) / x:+.1%}" if x else ""
+        print(f"{name:<22}{x:>12.3f}{y:>12.3f}{change:>10}")
+    p99_a, p99_b = a["callbacks"]["p99_ms"], b["callbacks"]["p99_ms"]
+    if max_regression is not None and p99_a and (p99_b - p99_a) / p99_a * 100.0 > max_regression:
+        print(f"\n❌ p99 block time regressed by more than {max_regression:g}%")
+        status = 1
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", nargs = "?", help = "script to replay into")
+    parser.add_argument("wav", nargs = "?", help = f"{SAMPLE_RATE} Hz 16-bit WAV to replay")
+    parser.add_argument("--synthetic", type = float, help = "replay this many seconds of synthetic speech instead")
+    parser.add_argument("--speed", type = float, default = 0, help = "x real time; 0: as fast as possible")
+    parser.add_argument("--blocksize", help = "frames per callback (default: the script's HOP_SIZE); "
+                                              "a comma-separated list picks one at random per block")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "max random delay per block, seconds")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--out", help = "output directory (default: replay_results/<script>_<time>)")
+    parser.add_argument("--publish", action = "store_true", help = "also publish events through the script's transport")
+    parser.add_argument("--console", action = "store_true", help = "show the script's output instead of console.log")
+    parser.add_argument("--compare", nargs = 2, metavar = ("A", "B"), help = "compare two replay results")
+    parser.add_argument("--max-regression", type = float, help = "--compare fails if p99 grew by more percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, max_regression = args.max_regression))
+    if not args.script or not (args.wav or args.synthetic):
+        parser.error("need a script and a WAV file (or --synthetic SECONDS)")
+    replay(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import time
+from collections import deque
+
+from deadline_timer import DeadlineTimer
+
+class RetentionManager:
+    """Keeps output directories under a byte and age budget, deleting the oldest files first.
+
+    Each directory is scanned once at startup; after that, files are registered
+    with `track()` as they are finalized, so enforcing the budget never rescans
+    the directory. All deletes run as jobs on the I/O worker. Age limits are
+    also enforced by a sweep every `sweep_interval` seconds.
+
+    `on_evict(name, path, size)` is called from the I/O thread for every
+    deleted file, so the caller can update its index.
+
+    A path is tracked once: tracking it again replaces the old entry, and
+    `forget()` drops it before the file is rewritten. Files are only deleted
+    if they are still the ones that were tracked (same inode and mtime), so a
+    later session that reuses a name never loses its file to an old entry.
+    """
+
+    def __init__(self, dirs, io, max_bytes = None, max_age = None, sweep_interval = 60.0,
+                 exclude = (), on_evict = None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.files_evicted = 0
+        self.bytes_evicted = 0
+        self._io = io
+        self._on_evict = on_evict
+        self._exclude = {os.path.abspath(p) for p in exclude}
+        # directory -> deque of (mtime, path, size, name, (inode, mtime_ns), key), oldest first;
+        # an entry is live while _entries[key] is it, replaced ones are skipped when reached
+        self._files = {os.path.abspath(d): deque() for d in dirs}
+        self._entries = {}  # absolute path -> its live entry
+        self._bytes = {d: 0 for d in self._files}
+        self._sweep_interval = sweep_interval
+        self._io.submit(self._scan, droppable = False)
+        self._timer = None
+        if max_age is not None:
+            self._timer = DeadlineTimer(self._on_sweep_timer, name = "retention-sweep")
+            self._timer.arm(sweep_interval)
+
+    def track(self, path, name = None):
+        """Register a finished file (non-blocking); `name` is its key in the index."""
+        self._io.submit(self._track, path, name or os.path.basename(path), droppable = False)
+
+    def forget(self, path):
+        """Stop accounting for `path` (non-blocking); call before a file of that name is rewritten."""
+        self._io.submit(self._forget, path, droppable = False)
+
+    def stats(self):
+        return {
+            "bytes_used": {os.path.relpath(d): b for d, b in self._bytes.items()},
+            "files_tracked": len(self._entries),
+            "files_evicted": self.files_evicted,
+            "bytes_evicted": self.bytes_evicted,
+        }
+
+    def stop(self, timeout = 5):
+        """Stop the sweeps and wait for the tracking and deletes queued so far, with their on_evict calls.
+
+        `track()` is often called from the I/O thread itself (after a close or an
+        encode), so close whatever on_evict writes to only after this returns.
+        """
+        if self._timer is not None:
+            self._timer.stop()
+        self._io.flush(timeout = timeout)
+
+    def _scan(self):
+        for directory, files in self._files.items():
+            found = []
+            for entry in os.scandir(directory):
+                key = os.path.join(directory, entry.name)
+                if entry.is_file() and key not in self._exclude and key not in self._entries:
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.path, st.st_size, entry.name, (st.st_ino, st.st_mtime_ns), key))
+            found.sort()
+            for entry in found:
+                self._add(directory, entry)
+            self._enforce(directory)
+
+    def _track(self, path, name):
+        key = os.path.abspath(path)
+        directory = os.path.dirname(key)
+        if directory not in self._files:
+            return
+        self._drop(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return  # removed before it could be tracked (e.g. a failed encode cleaned up)
+        self._add(directory, (time.time(), path, st.st_size, name, (st.st_ino, st.st_mtime_ns), key))
+        self._enforce(directory)
+
+    def _forget(self, path):
+        self._drop(os.path.abspath(path))
+
+    def _add(self, directory, entry):
+        self._files[directory].append(entry)
+        self._entries[entry[5]] = entry
+        self._bytes[directory] += entry[2]
+
+    def _drop(self, key):
+        """Stop accounting for the file at `key`; its deque entry is skipped once it is reached."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        directory = os.path.dirname(key)
+        self._bytes[directory] -= entry[2]
+        files = self._files[directory]
+        if len(files) > 2 * len(self._entries) + 64:
+            # replaced entries pile up while nothing is evicted: compact once they outnumber live ones
+            self._files[directory] = deque(f for f in files if self._entries.get(f[5]) is f)
+
+    def _on_sweep_timer(self):
+        self._io.submit(self._sweep, droppable = False)
+        self._timer.arm(self._sweep_interval)
+
+    def _sweep(self):
+        for directory in self._files:
+            self._enforce(directory)
+
+    def _enforce(self, directory):
+        files = self._files[directory]
+        now = time.time()
+        while files:
+            mtime, path, size, name, ident, key = files[0]
+            if self._entries.get(key) is not files[0]:
+                files.popleft()  # replaced or forgotten, its bytes are no longer counted
+                continue
+            over_budget = self.max_bytes is not None and self._bytes[directory] > self.max_bytes
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            if not (over_budget or too_old):
+                break
+            files.popleft()
+            del self._entries[key]
+            self._bytes[directory] -= size
+            try:
+                st = os.stat(path)
+                if (st.st_ino, st.st_mtime_ns) != ident:
+                    continue  # rewritten since it was tracked: not the file this entry stands for
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # already gone, just stop accounting for it
+            self.files_evicted += 1
+            self.bytes_evicted += size
+            if self._on_evict is not None:
+                self._on_evict(name, path, size)
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""SQLite index of segments and merges with time-range queries.
+
+    python segment_index.py segments.db --from 14:02 --to 14:05
+    python segment_index.py segments.db --from "2026-10-19 14:02" --to "2026-10-19 14:05" --stream mic-1
+
+Lists every segment / merge overlapping the window, oldest first.
+"""
+import argparse
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    stream_id       TEXT NOT NULL,
+    name            TEXT NOT NULL,  -- segment_times key, e.g. segment_3.wav or segment_1+segment_2.wav
+    file            TEXT,           -- file holding the audio (group, merged, compressed or session file)
+    start_ts        REAL,           -- unix time
+    end_ts          REAL,
+    start_sample    INTEGER,        -- offsets into `file`
+    end_sample      INTEGER,
+    duration        REAL,
+    merge_parent    TEXT,           -- name of the merge this segment became part of
+    smart_turn_prob REAL,
+    evicted         INTEGER,        -- 1 once retention deleted the file
+    PRIMARY KEY (stream_id, name)
+);
+-- range queries walk end_ts >= window start, which stays short for recent windows
+CREATE INDEX IF NOT EXISTS segments_end ON segments (end_ts);
+CREATE INDEX IF NOT EXISTS segments_stream_end ON segments (stream_id, end_ts);
+"""
+
+COLUMNS = ("file", "start_ts", "end_ts", "start_sample", "end_sample",
+           "duration", "merge_parent", "smart_turn_prob", "evicted")
+
+# insert a row, or fill in only the columns given for an existing one
+UPSERT = (
+    f"INSERT INTO segments (stream_id, name, {', '.join(COLUMNS)}) "
+    f"VALUES (?, ?, {', '.join('?' * len(COLUMNS))}) "
+    f"ON CONFLICT (stream_id, name) DO UPDATE SET "
+    + ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in COLUMNS)
+)
+
+class SegmentIndex:
+    """Writes segment rows into SQLite from a background thread in batched transactions.
+
+    `upsert()` only queues; the writer commits whatever piled up at most every
+    `batch_interval` seconds, so one commit (and fsync) covers many events.
+    It runs on its own thread rather than the I/O worker, so a slow commit
+    never holds up audio writes.
+    """
+
+    def __init__(self, db_path, stream_id, batch_interval = 0.5, batch_size = 256):
+        self.db_path = db_path
+        self.stream_id = stream_id
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.batches_written = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._run, name = "segment-index", daemon = True)
+        self._thread.start()
+
+    def upsert(self, name, **fields):
+        """Queue an insert/update of `name`; columns left out keep their stored value."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown segment index columns: {sorted(unknown)}")
+        self._queue.put((self.stream_id, name) + tuple(fields.get(c) for c in COLUMNS))
+
+    def close(self, timeout = 5):
+        """Commit everything queued so far and stop the writer."""
+        self._queue.put(None)
+        self._thread.join(timeout = timeout)
+
+    def _run(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.executescript(SCHEMA)
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.batch_interval
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout = max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            stop = item is None
+            if batch:
+                try:
+                    with db:
+                        db.executemany(UPSERT, batch)
+                    self.rows_written += len(batch)
+                    self.batches_written += 1
+                except sqlite3.Error as e:
+                    print("⚠️ Segment index write failed:", e)
+        db.close()
+
+def query_range(db_path, start_ts, end_ts, stream_id = None):
+    """Rows (as dicts) of segments overlapping [start_ts, end_ts], oldest first."""
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    sql = "SELECT * FROM segments WHERE end_ts >= ? AND start_ts <= ?"
+    params = [start_ts, end_ts]
+    if stream_id is not None:
+        sql += " AND stream_id = ?"
+        params.append(stream_id)
+    try:
+        return [dict(row) for row in db.execute(sql + " ORDER BY start_ts", params)]
+    finally:
+        db.close()
+
+def _parse_time(value, day):
+    """'HH:MM[:SS]' on `day`, or a full ISO date-time, as unix time."""
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        t = datetime.time.fromisoformat(value)
+        return datetime.datetime.combine(day, t).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", nargs = "?", default = "segments.db")
+    parser.add_argument("--from", dest = "start", required = True, help = "HH:MM[:SS] or ISO date-time")
+    parser.add_argument("--to", dest = "end", required = True, help = "HH:MM[:SS] or ISO date-time")
+    parser.add_argument("--date", type = datetime.date.fromisoformat, default = datetime.date.today(),
+                        help = "day for HH:MM times (default: today)")
+    parser.add_argument("--stream", help = "only this stream id")
+    args = parser.parse_args()
+
+    rows = query_range(args.db, _parse_time(args.start, args.date), _parse_time(args.end, args.date), args.stream)
+    for r in rows:
+        start = datetime.datetime.fromtimestamp(r["start_ts"]).strftime("%Y-%m-%d %H:%M:%S")
+        prob = "" if r["smart_turn_prob"] is None else f"  p={r['smart_turn_prob']:.2f}"
+        parent = f"  ⊂ {r['merge_parent']}" if r["merge_parent"] else ""
+        gone = "  (evicted)" if r["evicted"] else ""
+        print(f"{start}  {r['duration'] or 0:6.2f}s  {r['stream_id']}  {r['name']}  "
+              f"{r['file'] or '-'}[{r['start_sample']}:{r['end_sample']}]{prob}{parent}{gone}")
+    print(f"{len(rows)} segment(s)")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+from wav_sink import WAV_HEADER_SIZE, wav_header
+
+class SessionRecording:
+    """The whole session's int16 PCM in one preallocated, memory-mapped WAV file.
+
+    `append()` is a memcpy into the page cache, so the audio callback never
+    creates files or issues write syscalls. Segments and merges are described by
+    (start_sample, end_sample) ranges into this file instead of separate WAVs.
+    Once less than half of `grow_seconds` is left, the I/O worker extends the
+    file by `grow_seconds` and remaps it; frames that find no mapped space
+    (the growth fell behind) are dropped and counted in `samples_dropped`.
+    The file is truncated to the recorded length (with a correct header) on
+    close. Without an `io` worker, `append()` grows the file itself.
+    """
+
+    def __init__(self, path, sample_rate, grow_seconds = 3600, io = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.samples_written = 0
+        self.samples_dropped = 0
+        self._grow_samples = int(grow_seconds * sample_rate)
+        self._io = io
+        self._capacity = 0
+        self._mm = None
+        self._growing = False  # a _grow job is queued on the I/O worker
+        with open(path, "wb") as f:
+            f.write(wav_header(0, sample_rate))
+        self._grow()
+
+    def append(self, frame):
+        """Copy `frame` to the end of the recording; returns its start sample, or None if it was dropped."""
+        start = self.samples_written
+        end = start + len(frame)
+        mm = self._mm
+        if self._io is None:
+            if end > self._capacity:
+                self._grow()
+                mm = self._mm
+        elif not self._growing and self._capacity - end < self._grow_samples // 2:
+            self._growing = True
+            self._io.submit(self._grow, droppable = False)
+        if end > len(mm):
+            self.samples_dropped += len(frame)
+            return None
+        mm[start:end] = frame
+        self.samples_written = end
+        return start
+
+    def slice(self, start_sample, end_sample):
+        """Zero-copy view of already recorded samples."""
+        return self._mm[start_sample:min(end_sample, self.samples_written)]
+
+    def sync(self, on_done = None):
+        """msync the recording on the I/O worker; `on_done(error)` fires afterwards."""
+        if self._io is None:
+            self._mm.flush()
+            if on_done is not None:
+                on_done(None)
+            return
+        self._io.submit(self._sync, on_done = on_done, droppable = False)
+
+    def close(self):
+        """Flush, trim the preallocated tail and write the final header."""
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm = None
+        data_bytes = self.samples_written * 2
+        with open(self.path, "r+b") as f:
+            f.truncate(WAV_HEADER_SIZE + data_bytes)
+            f.write(wav_header(data_bytes, self.sample_rate))
+
+    def _sync(self):
+        mm = self._mm
+        if mm is not None:
+            mm.flush()
+
+    def _grow(self):
+        # the old and new mappings share the file's pages, so appends to the old one are kept
+        capacity = self._capacity + self._grow_samples
+        with open(self.path, "r+b") as f:
+            size = WAV_HEADER_SIZE + capacity * 2
+            if hasattr(os, "posix_fallocate"):
+                # reserve real blocks now, so page faults later never allocate
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+            # readers of a live session see the whole preallocated region
+            f.write(wav_header(capacity * 2, self.sample_rate))
+        self._mm = np.memmap(self.path, dtype = np.int16, mode = "r+",
+                             offset = WAV_HEADER_SIZE, shape = (capacity,))
+        self._capacity = capacity
+        self._growing = False
+
+def open_session(path):
+    """Read-only, zero-copy int16 view of a session recording (live or closed)."""
+    n_samples = (os.path.getsize(path) - WAV_HEADER_SIZE) // 2
+    return np.memmap(path, dtype = np.int16, mode = "r", offset = WAV_HEADER_SIZE, shape = (n_samples,))
+
+def read_segment(path, start_sample, end_sample):
+    """Zero-copy slice of one segment/merge index entry from a session recording."""
+    return open_session(path)[start_sample:end_sample]
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""Shared-memory event ring for consumers on the same host.
+
+    python shm_events.py [--name vad-events]      # print events as they arrive, with their latency
+
+With `EVENT_TRANSPORT = "shm"` the VAD scripts write every event frame (and
+live audio frame) into a ring buffer in shared memory (/dev/shm/<name> on
+Linux) as soon as it is published, instead of sending it to a WebSocket.
+There is no socket, server or batching delay: a reader polling the ring
+sees an event microseconds after it was published. Any number of readers
+follow the ring at their own pace. The writer never waits for them; a
+reader that falls more than the ring's size behind loses what was
+overwritten and counts it. The ring outlives the writer, so a restarted
+publisher continues it and readers need not reattach.
+
+Records hold the same frames as the WebSocket protocol (see ws_protocol),
+so `FrameCodec.decode()` reads them. Layout, little-endian, all offsets
+and lengths multiples of 8:
+
+    header, 64 bytes
+        0   8s   magic b"VADRING1"
+        8   u32  layout version (1)
+        12  u32  header size (64)
+        16  u64  capacity of the data area in bytes
+        24  u64  write position: bytes ever written, updated after the record is in place
+        32  u64  reserve position: bytes ever written or being written, updated before
+        40  u32  pid of the last writer
+    data area, `capacity` bytes from offset 64; a record never wraps around:
+        u32 length, u32 kind, `length` bytes of frame, zero padding to a multiple of 8
+        kind 1  binary frame (MessagePack events, or audio)
+        kind 2  JSON frame, UTF-8 (when msgpack is not installed)
+        kind 0  padding: nothing more until the end of the data area
+
+A record at position p is at offset 64 + p % capacity. A reader at
+position p reads records up to the write position. If the write position
+is more than `capacity` ahead it was lapped; if the reserve position is
+more than `capacity` ahead of the first record it copied, those records
+may have been overwritten while it copied them. Either way it skips to the
+write position.
+"""
+import argparse
+import os
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from ws_protocol import JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, FrameCodec, msgpack
+
+MAGIC = b"VADRING1"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQQI")
+HEADER_SIZE = 64
+WRITE_POS = 24
+RESERVE_POS = 32
+RECORD = struct.Struct("<II")
+
+KIND_PAD = 0
+KIND_BINARY = 1
+KIND_JSON = 2
+
+U64 = struct.Struct("<Q")
+
+def _padded(n):
+    return (n + 7) & ~7
+
+def _untrack(shm):
+    # the resource tracker would unlink the segment when this process exits,
+    # pulling it from under the other side
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+class RingWriter:
+    """Writes records into the ring `name`, creating it (or taking over one of the same size)."""
+
+    def __init__(self, name, capacity = 4 * 1024 * 1024):
+        capacity = _padded(capacity)
+        try:
+            self._shm = shared_memory.SharedMemory(name = name, create = True, size = HEADER_SIZE + capacity)
+            _untrack(self._shm)
+            HEADER.pack_into(self._shm.buf, 0, MAGIC, LAYOUT_VERSION, HEADER_SIZE, capacity, 0, 0, os.getpid())
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name = name)
+            magic, version, _, existing, *_ = HEADER.unpack_from(self._shm.buf)
+            if magic != MAGIC or version != LAYOUT_VERSION or existing != capacity:
+                # a ring in another layout or size: replace it (its readers keep the old one)
+                self._shm.close()
+                self._shm.unlink()
+                self.__init__(name, capacity)
+                return
+            _untrack(self._shm)
+            struct.pack_into("<I", self._shm.buf, 40, os.getpid())
+        self.name = name
+        self.capacity = capacity
+        self._buf = self._shm.buf
+        self._pos = U64.unpack_from(self._buf, WRITE_POS)[0]  # continue where the last writer stopped
+        self._lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, kind, fragments):
+        """Append one record made of the byte-like `fragments`; never blocks on readers."""
+        length = sum(len(f) for f in fragments)
+        size = RECORD.size + _padded(length)
+        if size > self.capacity:
+            raise ValueError(f"record of {length} bytes does not fit a ring of {self.capacity}")
+        with self._lock:
+            pos = self._pos
+            offset = pos % self.capacity
+            if offset + size > self.capacity:
+                # no room before the end: pad it out and start over at the beginning
+                U64.pack_into(self._buf, RESERVE_POS, pos + self.capacity - offset + size)
+                RECORD.pack_into(self._buf, HEADER_SIZE + offset, 0, KIND_PAD)
+                pos += self.capacity - offset
+                offset = 0
+            else:
+                U64.pack_into(self._buf, RESERVE_POS, pos + size)
+            at = HEADER_SIZE + offset
+            RECORD.pack_into(self._buf, at, length, kind)
+            at += RECORD.size
+            for f in fragments:
+                self._buf[at:at + len(f)] = f
+                at += len(f)
+            self._pos = pos + size
+            U64.pack_into(self._buf, WRITE_POS, self._pos)
+            self.records += 1
+            self.bytes += size
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        """Remove the ring; readers that have it open keep it until they close it."""
+        resource_tracker.register(self._shm._name, "shared_memory")  # unlink() unregisters it again
+        self._shm.unlink()
+
+class RingReader:
+    """Follows the ring `name` from its current write position."""
+
+    def __init__(self, name):
+        self._shm = shared_memory.SharedMemory(name = name)
+        _untrack(self._shm)
+        self._buf = self._shm.buf
+        magic, version, _, self.capacity, write_pos, _, _ = HEADER.unpack_from(self._buf)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            raise ValueError(f"{name} is not a version {LAYOUT_VERSION} event ring")
+        self.pos = write_pos  # the only record boundary known without walking the ring from its start
+        self.records = 0
+        self.lapped = 0  # times records were lost to the writer overtaking this reader
+        self.lost_bytes = 0
+
+    def read(self):
+        """Records written since the last call, oldest first: bytes (binary frames) or str (JSON)."""
+        write_pos = U64.unpack_from(self._buf, WRITE_POS)[0]
+        if write_pos < self.pos or write_pos - self.pos > self.capacity:
+            self._skip(write_pos)  # lapped, or a fresh ring replaced this one's contents
+            return []
+        first = self.pos
+        pos = first
+        out = []
+        while pos < write_pos:
+            offset = pos % self.capacity
+            length, kind = RECORD.unpack_from(self._buf, HEADER_SIZE + offset)
+            if kind == KIND_PAD:
+                pos += self.capacity - offset
+                continue
+            start = HEADER_SIZE + offset + RECORD.size
+            out.append((kind, bytes(self._buf[start:start + length])))
+            pos += RECORD.size + _padded(length)
+        # the copies are only good if the writer did not reach them while we copied
+        if U64.unpack_from(self._buf, RESERVE_POS)[0] - first > self.capacity:
+            self._skip(U64.unpack_from(self._buf, WRITE_POS)[0])
+            return []
+        self.pos = pos
+        self.records += len(out)
+        return [data.decode() if kind == KIND_JSON else data for kind, data in out]
+
+    def wait(self, timeout = None, spin = 0.001, sleep = 0.0005):
+        """Records as soon as there are any: busy-polls for `spin` seconds, then polls every `sleep`."""
+        start = time.perf_counter()
+        while True:
+            out = self.read()
+            if out:
+                return out
+            waited = time.perf_counter() - start
+            if timeout is not None and waited >= timeout:
+                return []
+            if waited >= spin:
+                time.sleep(sleep)
+
+    def stats(self):
+        return {"records": self.records, "lapped": self.lapped, "lost_bytes": self.lost_bytes}
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def _skip(self, write_pos):
+        self.lapped += 1
+        self.lost_bytes += max(0, write_pos - self.pos)
+        self.pos = write_pos
+
+class ShmPublisher:
+    """Drop-in for EventPublisher that writes frames to a RingWriter instead of a WebSocket.
+
+    `publish()` encodes and writes the event right away (a few microseconds,
+    no thread involved), one event per frame, so there is no batching delay,
+    queue or coalescing. Frames are MessagePack if installed, JSON otherwise.
+    """
+
+    def __init__(self, name, capacity = 4 * 1024 * 1024, stream_id = None):
+        self.stream_id = stream_id
+        self.ring = RingWriter(name, capacity)
+        self.codec = FrameCodec(MSGPACK_SUBPROTOCOL if msgpack is not None else JSON_SUBPROTOCOL)
+        self.kind = KIND_BINARY if self.codec.encoding == "msgpack" else KIND_JSON
+        self.sent_events = 0
+        self.sent_audio_frames = 0
+        self.oversize = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, payload, key = None, trace = None):
+        """Write an event to the ring; `key` is accepted for EventPublisher compatibility."""
+        with self._lock:
+            self._seq += 1
+            event = {"event": event_type, "data": payload, "seq": self._seq}
+            if trace is not None:
+                trace["publish"] = trace["send"] = time.monotonic()
+                event["trace"] = trace
+            frame = self.codec.encode({"stream": self.stream_id, "sent_at": time.time(), "events": [event]})
+            if self._write(self.kind, [frame.encode() if isinstance(frame, str) else frame]):
+                self.sent_events += 1
+                return True
+            return False
+
+    def publish_audio(self, segment, offset, samples):
+        """Write int16 `samples` of `segment` starting at sample `offset` within it."""
+        with self._lock:
+            if self._write(KIND_BINARY, self.codec.encode_audio(segment, offset, samples)):
+                self.sent_audio_frames += 1
+                return True
+            return False
+
+    def pending(self):
+        return 0
+
+    def stats(self):
+        return {
+            "ring": self.ring.name,
+            "sent_events": self.sent_events,
+            "sent_audio_frames": self.sent_audio_frames,
+            "records": self.ring.records,
+            "bytes": self.ring.bytes,
+            "oversize": self.oversize,
+            "codec": self.codec.stats(),
+        }
+
+    def stop(self, timeout = 2):
+        self.ring.close()
+
+    def _write(self, kind, fragments):
+        try:
+            self.ring.write(kind, fragments)
+        except ValueError as e:
+            self.oversize += 1
+            print(f"⚠️ Event not written: {e}")
+            return False
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--name", default = "vad-events", help = "ring to follow (SHM_NAME)")
+    args = parser.parse_args()
+
+    reader = RingReader(args.name)
+    codec = FrameCodec()
+    print(f"📡 Following {args.name} ({reader.capacity // 1024} KB ring)")
+    try:
+        while True:
+            for message in reader.wait():
+                now = time.time()
+                frame = codec.decode(message)
+                if "audio" in frame:
+                    audio = frame["audio"]
+                    print(f"🔊 segment {audio['segment']} +{audio['offset']}: {len(audio['samples'])} samples")
+                    continue
+                for event in frame["events"]:
+                    print(f"📥 {frame.get('stream')} [{(now - frame['sent_at']) * 1e6:.0f} us] "
+                          f"{event['event']}: {event['data']}")
+    except KeyboardInterrupt:
+        print(f"\n📊 Reader: {reader.stats()}")
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import math
 import urllib.request
@@ -11,6 +12,10 @@ import onnxruntime as ort
 
 from inference import predict_endpoint  # assumes 16 kHz mono float32 input
 
+# profiling.py lives in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import profiling
+
 # --- Configuration (fixed 16 kHz mono, 512-sample chunks) ---
 RATE = 16000
 CHUNK = 512                     # Silero VAD expects 512 samples at 16 kHz
@@ -195,4 +200,10 @@ def _process_segment(segment_audio_f32: np.ndarray):
 
 
 if __name__ == "__main__":
-    record_and_predict()
+    # --profile [cprofile]: see profiling.py
+    profiler = profiling.from_argv(hot_files=[__file__])
+    try:
+        record_and_predict()
+    finally:
+        if profiler is not None:
+            profiler.stop()
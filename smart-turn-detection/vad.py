@@ -1,22 +1,40 @@
 import numpy as np
 import sounddevice as sd
 import time
-import wave
 import os
 from ten_vad import TenVad
-import json
 import threading
-import queue
-import websocket
+import sys
+from collections import deque
 
 from inference import predict_endpoint
 
+# shared helpers (deadline_timer, ...) live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+import profiling
+from audio_encoder import EncoderPool
+from callback_monitor import CallbackMonitor
+from deadline_timer import DeadlineTimer
+from io_worker import IOWorker
+from retention import RetentionManager
+from segment_index import SegmentIndex
+from session_recording import SessionRecording
+from timestamp_log import TimestampLog
+from shm_events import ShmPublisher
+from ws_publisher import EventPublisher
+from wav_sink import WavWriter
+
+# `--profile [cprofile]` (see profiling.py), started before the threads below exist
+_profiler = profiling.from_argv(hot_files = [__file__]) if __name__ == "__main__" else None
+
 # Parameters
 SAMPLE_RATE = 16000
 HOP_SIZE = 256
 THRESHOLD = 0.7
 SILENCE_TIMEOUT = 1.5
 OVERRIDE_TIMEOUT = 2.0  # merging window
+SMART_TURN_SECONDS = 8  # predict_endpoint only looks at the last 8s
 
 RAW_DIR = "recordings"
 MERGE_DIR = "merged"
@@ -28,11 +46,53 @@ vad = TenVad(hop_size = HOP_SIZE, threshold = THRESHOLD)
 # State
 last_speech_time = None
 is_recording = False
-current_audio = []
+# rolling window of the current segment for Smart Turn; the full segment is
+# streamed to disk, so memory stays constant however long the utterance runs
+current_audio = deque(maxlen = SMART_TURN_SECONDS * SAMPLE_RATE // HOP_SIZE)
 
 segment_index = 0
 pending_group = []  # segment filenames waiting to be merged
 pending_close_time = None
+group_sink = None  # WAV the open group is streamed into, one file per group
+
+# all file writes (segment audio, renames, timestamp log) run on this worker;
+# a full queue drops audio frames instead of blocking the audio callback
+IO_QUEUE_SIZE = 2048
+_io = IOWorker(maxsize = IO_QUEUE_SIZE)
+# streams segment frames to disk as they are captured
+_wav_writer = WavWriter(io = _io)
+
+# final output format: "wav", or "flac" / "opus" (needs soundfile); finished
+# WAVs are re-encoded by ENCODER_WORKERS threads, off the audio callback
+OUTPUT_FORMAT = "wav"
+ENCODER_WORKERS = 2
+_encoder = EncoderPool(OUTPUT_FORMAT, _io, workers = ENCODER_WORKERS) if OUTPUT_FORMAT != "wav" else None
+
+# record the whole session into one memory-mapped WAV instead of one file per
+# group; segments and merges then only get (start_sample, end_sample) entries
+# in segment_times (read them with session_recording.read_segment)
+SESSION_RECORDING = False
+SESSION_FILE = os.path.join(RAW_DIR, time.strftime("session_%Y%m%d_%H%M%S.wav"))
+_session = SessionRecording(SESSION_FILE, SAMPLE_RATE, io = _io) if SESSION_RECORDING else None
+segment_start_sample = None
+segment_start_dropped = None
+
+# disk budget per output directory: the oldest files are deleted once a
+# directory holds more than RETENTION_MAX_BYTES or a file is older than
+# RETENTION_MAX_AGE seconds (None disables either limit)
+RETENTION_MAX_BYTES = 2 * 1024 ** 3
+RETENTION_MAX_AGE = None
+RETENTION_SWEEP_INTERVAL = 60.0
+
+# SQLite index of segments / merges for time-range queries (segment_index.py);
+# set STREAM_ID per microphone when several streams share one database or WS hub
+SEGMENT_INDEX_DB = "segments.db"
+STREAM_ID = "default"
+_index = SegmentIndex(SEGMENT_INDEX_DB, STREAM_ID)
+
+# guards pending_group / group_sink / pending_close_time,
+# which are shared between the audio callback and the finalize timer thread
+_state_lock = threading.Lock()
 
 start_time = time.time()   # track script runtime
 segment_start_time = None
@@ -42,146 +102,348 @@ segment_times = {}
 
 # json output file (only for logging not manually passed to websocket)
 TIMESTAMP_FILE = "timestamps.json"
+# updates are appended to timestamps.jsonl and compacted into TIMESTAMP_FILE
+TIMESTAMP_COMPACT_INTERVAL = 60.0
+_timestamp_log = TimestampLog(TIMESTAMP_FILE, compact_interval = TIMESTAMP_COMPACT_INTERVAL, io = _io)
+
+# Events: "ws" sends them to the WebSocket server at WS_URL; "shm" writes them
+# to the shared-memory ring SHM_NAME (see shm_events.py) for consumers on this
+# host, which see them within microseconds instead of a TCP round trip
+EVENT_TRANSPORT = "ws"
+SHM_NAME = "vad-events"
+SHM_SIZE = 4 * 1024 * 1024  # ring capacity in bytes; a reader this far behind loses events
 
 # WebSocket
 WS_URL = "ws://localhost:8765"
 
-# queue for messages to be sent over WebSocket
-_ws_queue = queue.Queue()
-_ws_stop_event = threading.Event()
+# events are packed into batched frames: a frame goes out WS_BATCH_DELAY
+# seconds after its first event, or once WS_BATCH_SIZE events are waiting
+WS_BATCH_DELAY = 0.02
+WS_BATCH_SIZE = 64
+# at most WS_QUEUE_SIZE events wait while the server is unreachable; when full,
+# WS_DROP_POLICY decides what goes ("drop-oldest", "drop-newest" or "priority",
+# which never drops merged/segment_saved for other events)
+WS_QUEUE_SIZE = 1000
+WS_DROP_POLICY = "priority"
+WS_STATS_INTERVAL = 10  # seconds between "stats" events (queue depth, drops, latency)
+# also stream segment audio live as binary int16 frames (segment number + sample
+# offset within the segment), so consumers need not wait for the file
+STREAM_AUDIO = False
+# stamp each event with the monotonic time of every pipeline stage it passed
+# (capture, VAD, disk, queue, send, ...; see trace_report.py); off costs nothing
+TRACE_EVENTS = False
+if EVENT_TRANSPORT == "shm":
+    _publisher = ShmPublisher(SHM_NAME, capacity = SHM_SIZE, stream_id = STREAM_ID)
+else:
+    _publisher = EventPublisher(WS_URL, max_batch_delay = WS_BATCH_DELAY, max_batch_size = WS_BATCH_SIZE,
+                                max_queue = WS_QUEUE_SIZE, drop_policy = WS_DROP_POLICY,
+                                stats_interval = WS_STATS_INTERVAL, stream_id = STREAM_ID)
+
+# Prometheus text format at http://localhost:METRICS_PORT/metrics (None = not served;
+# the metrics are kept either way, at about a microsecond per audio frame)
+METRICS_PORT = None
+_frames_total = metrics.counter("vad_frames_total", "Audio frames run through TEN-VAD")
+_vad_seconds = metrics.histogram("vad_process_seconds", "Duration of one TenVad.process call")
+_callback_seconds = metrics.histogram("vad_callback_seconds", "Duration of the audio callback")
+_status_total = metrics.counter("vad_audio_status_total", "sounddevice callback status flags raised", ("flag",))
+_segments_total = metrics.counter("vad_segments_saved_total", "Segments whose audio is durable on disk")
+_merges_total = metrics.counter("vad_merges_total", "Merged groups of segments")
+_merge_seconds = metrics.histogram("vad_merge_seconds", "Merge deadline to merged file closed and renamed")
+_smart_turn_seconds = metrics.histogram("vad_smart_turn_seconds", "Duration of predict_endpoint")
+# every audio callback is timed against its budget (frames / SAMPLE_RATE); overruns
+# are printed with the time each phase took (vad, log, write, close_segment, ...)
+CALLBACK_PROFILE = False  # also sample the callback's stack during overruns (diagnosis only, adds latency)
+CALLBACK_REPORT_FILE = "callback_overruns.json"  # the worst overruns, written on exit if there were any
+_callback_monitor = CallbackMonitor(SAMPLE_RATE, profile = CALLBACK_PROFILE)
+metrics.counter("vad_callback_overruns_total", "Audio callbacks that took longer than their block",
+                fn = lambda: _callback_monitor.overruns)
+
+metrics.gauge("vad_events_queued", "Events waiting in the publisher queue", fn = _publisher.pending)
+metrics.counter("vad_events_sent_total", "Events sent (WebSocket) or written (shared memory)",
+                fn = lambda: _publisher.sent_events)
+metrics.counter("vad_ws_frames_sent_total", "WebSocket frames sent",
+                fn = lambda: getattr(_publisher, "sent_frames", 0))
+metrics.counter("vad_ws_send_failures_total", "WebSocket sends that failed",
+                fn = lambda: getattr(_publisher, "send_failures", 0))
+metrics.counter("vad_ws_reconnects_total", "WebSocket reconnect attempts",
+                fn = lambda: getattr(_publisher, "reconnects", 0))
+metrics.counter("vad_events_dropped_total", "Events dropped because the publisher queue was full",
+                fn = lambda: sum(getattr(_publisher, "dropped", {}).values()))
+
+def send_ws_event(event_type, payload, key = None, trace = None):
+    """Queue an event for the WebSocket publisher, or write it to the shared-memory ring (non-blocking).
+
+    Events with the same `key` (the segment number) can coalesce, e.g. a
+    speech_start that is still queued when its segment_saved arrives.
+    `trace` holds the stage stamps collected so far (None unless TRACE_EVENTS).
+    """
+    _publisher.publish(event_type, payload, key = key, trace = trace)
+
+def record_timestamps(name, entry):
+    """Store one segment_times entry and append it to the timestamp log (non-blocking)."""
+    segment_times[name] = entry
+    _timestamp_log.append(name, entry)
+
+def finalize_pending(due_only = False):
+    """Finalize pending group: keep it in RAW folder, or move it to MERGE_DIR (if >1 part).
 
-def ws_sender_loop():
-    """Background thread: connect to WS_URL and send queued messages.
-       Uses websocket-client (synchronous API) so it is easy to run in a thread.
+    The whole group was streamed into one WAV while it was open, so finalizing
+    is just a header patch and a rename on the I/O thread. With `due_only`
+    nothing happens if resumed speech cancelled the merge window meanwhile.
     """
-    while not _ws_stop_event.is_set():
-        try:
-            ws = websocket.create_connection(WS_URL, timeout = 5)
-            print(f"🌐 WebSocket connected to {WS_URL}")
-            while not _ws_stop_event.is_set():
-                try:
-                    msg = _ws_queue.get(timeout = 1)  # blocking with timeout
-                except queue.Empty:
-                    continue
-                try:
-                    ws.send(msg)
-                except Exception as e:
-                    print("⚠️ WS send failed:", e)
-                    try:
-                        ws.close()
-                    except:
-                        pass
-                    break
-            try:
-                ws.close()
-            except:
-                pass
-        except Exception as e:
-            # connection failed — will retry after a short pause
-            print("⚠️ WS connection error:", e)
-            time.sleep(2)
-
-def send_ws_event(event_type, payload):
-    """Push JSON message to websocket queue (non-blocking)."""
-    message = {"event": event_type, "data": payload}
-    try:
-        _ws_queue.put_nowait(json.dumps(message))
-    except Exception as e:
-        print("⚠️ Failed to enqueue WS message:", e)
-
-_ws_thread = threading.Thread(target = ws_sender_loop, daemon = True)
-_ws_thread.start()
-
-def save_timestamps():
-    """Persist current segment_times dict into a JSON file."""
-    with open(TIMESTAMP_FILE, "w", encoding = "utf-8") as f:
-        json.dump(segment_times, f, indent = 4)
-
-def save_wav(filename, audio_data):
-    with wave.open(filename, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(SAMPLE_RATE)
-        wf.writeframes(audio_data.tobytes())
-
-def read_wav(filename):
-    with wave.open(filename, "rb") as rf:
-        params = rf.getparams()
-        audio = np.frombuffer(rf.readframes(rf.getnframes()), dtype = np.int16)
-    return audio, params
-
-def merge_wavs(files, out_file):
-    merged_audio = []
-    params = None
-    for f in files:
-        data, p = read_wav(f)
-        merged_audio.append(data)
-        if params is None:
-            params = p
-    merged_audio = np.concatenate(merged_audio)
-    with wave.open(out_file, "wb") as wf:
-        wf.setparams(params)
-        wf.writeframes(merged_audio.tobytes())
-
-def finalize_pending():
-    """Finalize pending group into a merged file (if >1 part)."""
-    global pending_group
-    if not pending_group:
+    global pending_group, pending_close_time, group_sink
+    trace = {"timer": time.monotonic()} if TRACE_EVENTS else None
+    started = time.perf_counter()
+    with _state_lock:
+        if due_only and pending_close_time is None:
+            return
+        group, sink = pending_group, group_sink
+        pending_group, group_sink = [], None
+        pending_close_time = None
+    if _session is not None and group:
+        # nothing to write, the parts already live in the session recording
+        if len(group) == 1:
+            print(f"✅ Finalized single: {group[0]}")
+        else:
+            merged_name = "+".join([os.path.basename(p).replace(".wav", "") for p in group]) + ".wav"
+            _on_merged(group, merged_name, None, trace)
         return
-    if len(pending_group) == 1:
-        # Just one file, keep it as is in RAW folder
-        print(f"✅ Finalized single: {pending_group[0]}")
+    if sink is None:
+        return
+    if len(group) <= 1:
+        # Just one segment, keep it as is in RAW folder
+        def _on_closed(error):
+            if error is None:
+                print(f"✅ Finalized single: {sink.path}")
+                finalize_output(os.path.basename(sink.path), sink.path)
+        sink.close(on_done = _on_closed)
     else:
         merged_name = os.path.join(
             MERGE_DIR,
-            "+".join([os.path.basename(p).replace(".wav", "") for p in pending_group]) + ".wav"
+            "+".join([os.path.basename(p).replace(".wav", "") for p in group]) + ".wav"
         )
-        merge_wavs(pending_group, merged_name)
-        print(f"🔗 Created merged file: {merged_name}")
-
-        # compute absolute start/end times of merged group
-        first_seg = pending_group[0]
-        last_seg = pending_group[-1]
-
-        # note: keys in segment_times are base filenames (we save as basename)
-        start_abs = segment_times.get(os.path.basename(first_seg), {}).get("start")
-        end_abs = segment_times.get(os.path.basename(last_seg), {}).get("end")
-
-        if start_abs is not None and end_abs is not None:
-            duration = end_abs - start_abs
-            print(f"⏱️ Merged absolute time range: {start_abs:.2f}s → {end_abs:.2f}s "
-                  f"(duration {duration:.2f}s)")
-
-            # save merged timestamps
-            segment_times[os.path.basename(merged_name)] = {
-                "start": start_abs,
-                "end": end_abs,
-                "duration": duration
-            }
-            save_timestamps()
-
-            # Send WebSocket event for merged file
-            send_ws_event("merged", {
-                "merged_file": os.path.basename(merged_name),
-                "parts": [os.path.basename(p) for p in pending_group],
-                "start": start_abs,
-                "end": end_abs,
-                "duration": duration
-            })
-
-        # Delete originals from RAW folder
-        for p in pending_group:
-            if os.path.exists(p):
-                os.remove(p)
-    pending_group = []
+        def _on_renamed(error):
+            _merge_seconds.observe(time.perf_counter() - started)
+            if trace is not None:
+                trace["disk"] = time.monotonic()
+            _on_merged(group, merged_name, error, trace)
+        sink.close(final_path = merged_name, on_done = _on_renamed)
+
+def _on_merged(group, merged_name, error, trace = None):
+    """Runs on the I/O thread once the merged file is closed and renamed."""
+    if error is not None:
+        return
+    _merges_total.inc()
+    print(f"🔗 Created merged file: {merged_name}")
+
+    # compute absolute start/end times of merged group
+    first_seg = group[0]
+    last_seg = group[-1]
+
+    # note: keys in segment_times are base filenames (we save as basename)
+    start_abs = segment_times.get(os.path.basename(first_seg), {}).get("start")
+    end_abs = segment_times.get(os.path.basename(last_seg), {}).get("end")
+
+    if start_abs is not None and end_abs is not None:
+        duration = end_abs - start_abs
+        print(f"⏱️ Merged absolute time range: {start_abs:.2f}s → {end_abs:.2f}s "
+              f"(duration {duration:.2f}s)")
+
+        # the merge spans the first part's start to the last part's end
+        sample_range = {
+            "start_sample": segment_times[os.path.basename(first_seg)]["start_sample"],
+            "end_sample": segment_times[os.path.basename(last_seg)]["end_sample"],
+        }
+        if _session is not None:
+            sample_range["session_file"] = os.path.basename(_session.path)
+
+        # save merged timestamps
+        record_timestamps(os.path.basename(merged_name), dict({
+            "start": start_abs,
+            "end": end_abs,
+            "duration": duration
+        }, **sample_range))
+
+        # Send WebSocket event for merged file
+        send_ws_event("merged", dict({
+            "merged_file": os.path.basename(merged_name),
+            "parts": [os.path.basename(p) for p in group],
+            "start": start_abs,
+            "end": end_abs,
+            "duration": duration
+        }, **sample_range), trace = trace)
+
+        audio_file = _session.path if _session is not None else merged_name
+        _index.upsert(os.path.basename(merged_name), file = audio_file,
+                      start_ts = start_time + start_abs, end_ts = start_time + end_abs,
+                      start_sample = sample_range["start_sample"], end_sample = sample_range["end_sample"],
+                      duration = duration)
+        for p in group:
+            _index.upsert(os.path.basename(p), file = audio_file, merge_parent = os.path.basename(merged_name))
+            if _session is None and os.path.basename(p) in segment_times:
+                # the group file the parts point at is now the merged file
+                record_timestamps(os.path.basename(p), dict(segment_times[os.path.basename(p)],
+                                                            file = os.path.basename(merged_name)))
+    if _session is None:
+        finalize_output(os.path.basename(merged_name), merged_name, [os.path.basename(p) for p in group])
+
+def finalize_output(name, wav_path, parts = ()):
+    """Hand a finalized WAV to the encoder pool (if OUTPUT_FORMAT is compressed) and to retention.
+
+    `parts` are the names of the merged segments whose audio is in the file.
+    """
+    if _encoder is None:
+        _retention.track(wav_path, name)
+        return
+
+    def _on_encoded(out_path, stats, error):
+        if error is not None:
+            # the WAV stays the output; it still counts against the disk budget
+            print(f"⚠️ Keeping {wav_path} as WAV, encoding failed:", error)
+            _retention.track(wav_path, name)
+            return
+        print(f"🗜️ Encoded {out_path} ({stats['pcm_bytes']} → {stats['encoded_bytes']} bytes, "
+              f"{stats['encode_ms']:.1f} ms)")
+        # record the final file and its format next to the segment's times
+        entry = dict(segment_times.get(name, {}))
+        entry.update({"file": os.path.basename(out_path), "format": stats["format"]})
+        record_timestamps(name, entry)
+        send_ws_event("encoded", dict(stats, source = name, file = os.path.basename(out_path)))
+        _retention.track(out_path, name)
+        _index.upsert(name, file = out_path)
+        for part in parts:
+            _index.upsert(part, file = out_path)
+            if part in segment_times:
+                record_timestamps(part, dict(segment_times[part], file = os.path.basename(out_path)))
+    _encoder.submit(wav_path, on_done = _on_encoded)
+
+def _on_evicted(name, path, size):
+    """Runs on the I/O thread when retention deleted a file to stay within budget."""
+    print(f"🧹 Evicted {path} ({size} bytes)")
+    if name in segment_times:
+        record_timestamps(name, dict(segment_times[name], evicted = True))
+    _index.upsert(name, evicted = 1)
+    send_ws_event("evicted", dict(_retention.stats(), file = os.path.basename(path), name = name))
+
+_retention = RetentionManager(
+    [RAW_DIR, MERGE_DIR], _io,
+    max_bytes = RETENTION_MAX_BYTES,
+    max_age = RETENTION_MAX_AGE,
+    sweep_interval = RETENTION_SWEEP_INTERVAL,
+    exclude = [SESSION_FILE],
+    on_evict = _on_evicted,
+)
+
+def _on_finalize_deadline():
+    """Runs on the timer thread once OVERRIDE_TIMEOUT passed without new speech."""
+    finalize_pending(due_only = True)
+
+# fires finalize_pending exactly OVERRIDE_TIMEOUT after the last segment closed
+_finalize_timer = DeadlineTimer(_on_finalize_deadline, name = "finalize-timer")
+
+def start_segment(trace = None):
+    """Start recording a segment; it joins the open group or opens a new group file."""
+    global is_recording, segment_start_time, segment_start_sample, segment_start_dropped, pending_close_time, \
+        group_sink
+    print("🟢 Speech started")
+    is_recording = True
+    # mark speech start absolute time
+    segment_start_time = time.time() - start_time
+
+    with _state_lock:
+        pending_close_time = None  # cancel pending finalize
+        if group_sink is None and _session is None:
+            # the group file is named after its first segment; a file of that
+            # name left by an earlier session is overwritten, not evicted later
+            group_path = os.path.join(RAW_DIR, f"segment_{segment_index + 1}.wav")
+            _retention.forget(group_path)
+            group_sink = _wav_writer.open(group_path, SAMPLE_RATE)
+    _finalize_timer.cancel()
+    # offset of the segment in the session recording, or in its group file
+    segment_start_sample = _session.samples_written if _session is not None else group_sink.samples_queued
+    segment_start_dropped = (_session or group_sink).samples_dropped
+
+    # send WS event for speech start
+    send_ws_event("speech_start", {
+        "segment": segment_index + 1,
+        "timestamp": segment_start_time,
+    }, key = segment_index + 1, trace = trace)
+
+def close_segment(smart_turn_prob = None, trace = None):
+    """Close the segment being recorded and add it to the pending merge group."""
+    global is_recording, segment_index, pending_close_time
+    segment_index += 1
+    filename = os.path.join(RAW_DIR, f"segment_{segment_index}.wav")
+    print(f"💾 Saved {filename}")
+
+    # record absolute start/end + duration
+    segment_end_time = time.time() - start_time
+    duration = segment_end_time - segment_start_time
+    sink = _session or group_sink
+    sample_range = {
+        "start_sample": segment_start_sample,
+        "end_sample": _session.samples_written if _session is not None else group_sink.samples_queued,
+    }
+    if _session is not None:
+        sample_range["session_file"] = os.path.basename(_session.path)
+    if sink.samples_dropped > segment_start_dropped:
+        # frames the full I/O queue dropped are missing from the file, not just late
+        sample_range["dropped_samples"] = sink.samples_dropped - segment_start_dropped
+    # the segment's audio is in its group file (named after the group's first
+    # segment) or in the session recording, at sample_range
+    entry = dict({
+        "file": os.path.basename(sink.path),
+        "start": segment_start_time,
+        "end": segment_end_time,
+        "duration": duration
+    }, **sample_range)
+    if smart_turn_prob is not None:
+        entry["smart_turn_probability"] = smart_turn_prob
+    record_timestamps(os.path.basename(filename), entry)
+    _index.upsert(os.path.basename(filename), file = sink.path,
+                  start_ts = start_time + segment_start_time, end_ts = start_time + segment_end_time,
+                  start_sample = sample_range["start_sample"], end_sample = sample_range["end_sample"],
+                  duration = duration, smart_turn_prob = smart_turn_prob)
+
+    # Send WS event for saved segment once its audio is durable on disk
+    saved = dict({
+        "segment": segment_index,
+        "file": os.path.basename(sink.path),
+        "start": segment_start_time,
+        "end": segment_end_time,
+        "duration": duration
+    }, **sample_range)
+    def _on_synced(error):
+        if error is None:
+            _segments_total.inc()
+            if trace is not None:
+                trace["disk"] = time.monotonic()
+            send_ws_event("segment_saved", saved, key = saved["segment"], trace = trace)
+    sink.sync(on_done = _on_synced)
+
+    with _state_lock:
+        pending_group.append(filename)
+        pending_close_time = time.time()
+    _finalize_timer.arm(OVERRIDE_TIMEOUT)
+    is_recording = False
 
 def audio_callback(indata, frames, t, status):
-    global last_speech_time, is_recording, current_audio
-    global segment_index, pending_group, pending_close_time
-    global segment_start_time
+    global last_speech_time
 
+    _callback_monitor.begin(status)
+    if _profiler is not None:
+        _profiler.enter_thread()  # PortAudio's thread, which cProfile does not see on its own
     if status:
         print("⚠️", status)
+        for name in ("input_overflow", "input_underflow"):
+            if getattr(status, name):
+                _status_total.labels(name).inc()
+
+    stamps = None
+    if TRACE_EVENTS:
+        callback_time = time.monotonic()
+        # PortAudio's stream clock says how long ago the first sample reached the ADC (0 = unknown)
+        adc_time = callback_time - (t.currentTime - t.inputBufferAdcTime) if t.inputBufferAdcTime else None
 
     # Convert float input [-1, 1] to int16
     audio_chunk = (indata[:, 0] * 32767).astype(np.int16)
@@ -191,109 +453,130 @@ def audio_callback(indata, frames, t, status):
         if len(frame) < HOP_SIZE:
             frame = np.pad(frame, (0, HOP_SIZE - len(frame)))
 
+        _callback_monitor.phase("vad")
+        vad_start = time.perf_counter()
         prob, flag = vad.process(frame)
-
-        # Always append the frame to current audio buffer
-        current_audio.extend(frame.tolist())
-
+        _vad_seconds.observe(time.perf_counter() - vad_start)
+        _frames_total.inc()
+        if TRACE_EVENTS:
+            stamps = {"callback": callback_time, "vad": time.monotonic()}
+            if adc_time is not None:
+                stamps["capture"] = adc_time + start / SAMPLE_RATE
+
+        _callback_monitor.phase("log")
         if flag == 1:  # speech
             print(f"🟢 Speech detected (p={prob:.2f})")
             if not is_recording:
-                print("🟢 Speech started")
-                is_recording = True
-                current_audio = frame.tolist()  # start fresh buffer
-                segment_start_time = time.time() - start_time
-
-                send_ws_event("speech_start", {"timestamp": segment_start_time})
-
+                _callback_monitor.phase("start_segment")
+                current_audio.clear()  # start fresh buffer
+                start_segment(trace = stamps)
             last_speech_time = time.time()
-
-            # Cancel pending finalize if within override window
-            if pending_close_time and (time.time() - pending_close_time) <= OVERRIDE_TIMEOUT:
-                pending_close_time = None
-
         else:  # silence
             print(f"⚪ Silence (p={prob:.2f})")
 
-            if last_speech_time and (time.time() - last_speech_time > SILENCE_TIMEOUT):
-                if is_recording and len(current_audio) > 0:
-                    # 🔹 Smart Turn check
-                    float_audio = np.array(current_audio, dtype=np.float32) / 32767.0
-                    result = predict_endpoint(float_audio)  # automatically handles <8s vs >8s
-
-                    print("🤖 Smart Turn raw:", result)
-
-                    if result.get("prediction", 1) == 0:
-                        print("🤖 Smart Turn: Incomplete → continue listening")
-                        return
-                    else:
-                        print("🤖 Smart Turn: Complete → finalize segment")
-
-                    # Save segment
-                    audio_data = np.array(current_audio, dtype=np.int16)
-                    segment_index += 1
-                    filename = os.path.join(RAW_DIR, f"segment_{segment_index}.wav")
-                    save_wav(filename, audio_data)
-                    print(f"💾 Saved {filename}")
-
-                    segment_end_time = time.time() - start_time
-                    duration = segment_end_time - segment_start_time
-                    segment_times[os.path.basename(filename)] = {
-                        "start": segment_start_time,
-                        "end": segment_end_time,
-                        "duration": duration
-                    }
-                    save_timestamps()
-
-                    send_ws_event("segment_saved", {
-                        "file": os.path.basename(filename),
-                        "start": segment_start_time,
-                        "end": segment_end_time,
-                        "duration": duration
-                    })
-
-                    pending_group.append(filename)
-                    pending_close_time = time.time()
-
-                # Reset recording state
-                is_recording = False
-                current_audio = []
+        # Stream every frame of the segment to disk (and WS) and keep the tail for
+        # Smart Turn; frames are fresh arrays, so none of them needs a copy
+        _callback_monitor.phase("write")
+        if _session is not None:
+            position = _session.append(frame)  # the whole session, silence included
+        if is_recording:
+            current_audio.append(frame)
+            if _session is None:
+                position = group_sink.samples_queued
+                if not group_sink.write(frame):
+                    position = None  # not in the file, so not streamed either
+            if STREAM_AUDIO and position is not None:
+                _callback_monitor.phase("publish")
+                # live to WS subscribers, from the same array the writer holds
+                _publisher.publish_audio(segment_index + 1, position - segment_start_sample, frame)
+
+        if flag != 1 and last_speech_time and (time.time() - last_speech_time > SILENCE_TIMEOUT):
+            if is_recording:
+                # 🔹 Smart Turn check
+                _callback_monitor.phase("smart_turn")
+                float_audio = np.concatenate(current_audio).astype(np.float32) / 32767.0
+                smart_turn_start = time.perf_counter()
+                result = predict_endpoint(float_audio)  # automatically handles <8s vs >8s
+                _smart_turn_seconds.observe(time.perf_counter() - smart_turn_start)
+                if stamps is not None:
+                    stamps["smart_turn"] = time.monotonic()
+                if result.get("pending"):
+                    # vad_pipeline.py: the inference stage has not answered yet, keep listening
+                    _callback_seconds.observe(_callback_monitor.end(frames))
+                    return
+
+                print("🤖 Smart Turn raw:", result)
+
+                if result.get("prediction", 1) == 0:
+                    print("🤖 Smart Turn: Incomplete → continue listening")
+                    _callback_seconds.observe(_callback_monitor.end(frames))
+                    return
+                else:
+                    print("🤖 Smart Turn: Complete → finalize segment")
+
+                _callback_monitor.phase("close_segment")
+                close_segment(smart_turn_prob = result.get("probability"), trace = stamps)
+
+    _callback_seconds.observe(_callback_monitor.end(frames))
+
+def shutdown():
+    """Keep the cut-off utterance, finalize the open group, drain all file I/O and stop the background threads."""
+    _finalize_timer.stop()
+    if is_recording:
+        close_segment()  # keep the utterance that was cut off
+    finalize_pending()  # finalize leftovers
+    _io.flush()  # let the merged callbacks record their timestamps
+    if _encoder is not None:
+        _encoder.shutdown()
+        _io.flush()
+
+    total_runtime = time.time() - start_time
+    print(f"⏱️ Total runtime: {total_runtime:.2f} seconds "
+          f"({total_runtime/60:.2f} minutes)")
+
+    # save total runtime in JSON too
+    record_timestamps("__summary__", {
+        "total_runtime_seconds": total_runtime,
+        "total_runtime_minutes": total_runtime / 60,
+        "output_format": OUTPUT_FORMAT
+    })
+
+    # evictions still record timestamps and index rows, so retention drains first;
+    # then compact the timestamp log and drain all pending file I/O
+    _retention.stop()
+    _timestamp_log.close()
+    _index.close()
+    _io.stop()
+    if _session is not None:
+        _session.close()
+    print(f"💽 I/O stats: {_io.stats()}")
+    print(f"🧹 Retention: {_retention.stats()}")
+    _callback_monitor.stop()
+    print(f"⏱️ Callbacks: {_callback_monitor.stats()}")
+    if _callback_monitor.overruns:
+        _callback_monitor.dump(CALLBACK_REPORT_FILE)
+        print(f"⏱️ Worst overruns written to {CALLBACK_REPORT_FILE}")
+
+    # send what is still queued and shut the publisher down
+    _publisher.stop(timeout = 2)
+    print(f"🌐 WS stats: {_publisher.stats()}")
 
 if __name__ == "__main__":
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
     print("🎙️ TEN-VAD streaming... speak now! (Ctrl+C to stop)")
     try:
         with sd.InputStream(callback = audio_callback,
                             channels = 1,
                             samplerate = SAMPLE_RATE,
                             blocksize = HOP_SIZE):
+            # pending groups are finalized by _finalize_timer, the main
+            # thread only has to keep the stream open
             while True:
-                # Check if pending group should be finalized
-                if pending_close_time and (time.time() - pending_close_time) > OVERRIDE_TIMEOUT:
-                    finalize_pending()
-                    pending_close_time = None
-                time.sleep(0.1)
+                time.sleep(3600)
     except KeyboardInterrupt:
         print("\n🛑 Stopped by user.")
-        finalize_pending()  # finalize leftovers
-
-        total_runtime = time.time() - start_time
-        print(f"⏱️ Total runtime: {total_runtime:.2f} seconds "
-              f"({total_runtime/60:.2f} minutes)")
-
-        # save total runtime in JSON too
-        segment_times["__summary__"] = {
-            "total_runtime_seconds": total_runtime,
-            "total_runtime_minutes": total_runtime / 60
-        }
-        save_timestamps()
-
-    # Shutdown WS thread cleanly
-    _ws_stop_event.set()
-    try:
-        # push a no-op message to wake the sender (if blocked)
-        _ws_queue.put_nowait(json.dumps({"event":"shutdown","data":{}}))
-    except Exception:
-        pass
-    # give the sender thread a moment to exit
-    _ws_thread.join(timeout=2)
+    shutdown()
+    if _profiler is not None:
+        _profiler.stop()
     print("✅ Exiting.")
\ No newline at end of file
@@ -0,0 +1,375 @@
+"""vad.py as three processes: capture, VAD / segmentation and Smart Turn inference.
+
+    python smart-turn-detection/vad_pipeline.py
+
+In vad.py the capture callback, TEN-VAD, Smart Turn (feature extraction
+and ONNX, tens to hundreds of milliseconds) and the WS publisher share one
+process and one GIL, so an inference runs inside the audio callback and a
+slow one costs input overflows. Here the same code runs in three stages
+connected by shared-memory rings (shm_events.RingWriter / RingReader):
+
+    capture ──audio ring──▶ VAD ──request ring──▶ inference
+                             ▲                        │
+                             └──────result ring───────┘
+
+    capture     the sounddevice stream; its callback copies each block into the
+                audio ring, with a sequence number, the capture time and the
+                status flags, and does nothing else.
+    VAD         vad.py imported as a module: every block goes through its
+                audio_callback, so segments, files, timestamps, the index and
+                events are those of vad.py. Its time.time() is the capture time
+                of the block being processed, so segment times are the audio's
+                even when the stage runs behind. Smart Turn is a request to the
+                inference stage instead of a call.
+    inference   loads the Smart Turn model and answers requests in order.
+
+Backpressure:
+
+    audio ring      capture never waits. The ring holds AUDIO_RING_SECONDS of
+                    audio; a VAD stage that falls further behind skips to the
+                    newest audio and counts the blocks it lost (sequence gaps).
+                    Shorter stalls (disk, GC, a merge) only add lag.
+    request ring    one request in flight: while the inference stage works, the
+                    VAD stage goes on with the audio, and the segment stays open
+                    until the answer is back (vad.py treats it like
+                    "incomplete"). An answer to a request sent before speech
+                    resumed is discarded. Inference time delays the end-of-turn
+                    decision, never capture or VAD.
+    result ring     one small record per request.
+
+Every STATS_INTERVAL seconds the throughput and CPU of each stage, the VAD
+stage's lag behind capture, lost audio and inference times are printed, and
+with PIPELINE_METRICS_PORT served as Prometheus metrics (vad.py's own
+metrics are served by the VAD stage at its METRICS_PORT). Ctrl+C stops
+capture first; the VAD stage then works off the audio ring and shuts down
+like vad.py does, and the inference stage stops last.
+"""
+import multiprocessing as mp
+import os
+import signal
+import struct
+import sys
+import time
+import types
+from collections import namedtuple
+
+import numpy as np
+
+# shared helpers (shm_events, metrics, ...) live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+from shm_events import KIND_BINARY, RECORD, RingReader, RingWriter
+
+SAMPLE_RATE = 16000
+HOP_SIZE = 256
+
+# shared-memory rings between the stages (/dev/shm/<name>), removed on exit
+AUDIO_RING = "vad-pipeline-audio"
+AUDIO_RING_SECONDS = 30  # a VAD stage this far behind capture loses audio
+REQUEST_RING = "vad-pipeline-requests"
+REQUEST_RING_SIZE = 2 * 1024 * 1024  # an 8 s request is 512 KB
+RESULT_RING = "vad-pipeline-results"
+RESULT_RING_SIZE = 64 * 1024
+
+# sleep between polls of an empty ring; the VAD stage's adds up to this much lag
+VAD_POLL_INTERVAL = 0.002
+INFERENCE_POLL_INTERVAL = 0.005
+STAGE_START_TIMEOUT = 120  # seconds, the inference stage loads the model
+STATS_INTERVAL = 5.0
+PIPELINE_METRICS_PORT = None
+
+# record layouts
+BLOCK = struct.Struct("<QdI")  # sequence number, capture time.time(), status flags; float32 samples follow
+REQUEST = struct.Struct("<Qd")  # request id, sent at (capture time); float32 audio follows
+RESULT = struct.Struct("<Qidd")  # request id, prediction, probability, inference seconds
+INPUT_OVERFLOW = 1
+INPUT_UNDERFLOW = 2
+
+# counters each stage keeps in a shared array; the ones not in GAUGES only grow
+STAGE_FIELDS = {
+    "capture": ("blocks", "frames", "overflows", "cpu_s"),
+    "vad": ("blocks", "frames", "lost_blocks", "busy_s", "lag_ms", "lag_max_ms", "requests", "answers", "stale",
+            "cpu_s"),
+    "inference": ("requests", "busy_s", "last_ms", "max_ms", "cpu_s"),
+}
+GAUGES = ("lag_ms", "lag_max_ms", "last_ms", "max_ms")
+
+# the `time` argument of audio_callback; an ADC time of 0 means unknown
+StreamTime = namedtuple("StreamTime", "inputBufferAdcTime currentTime outputBufferDacTime")
+
+class StageStats:
+    """A stage's counters by name, in a shared array the orchestrator reads."""
+
+    def __init__(self, array, stage):
+        self.array = array
+        self._index = {name: i for i, name in enumerate(STAGE_FIELDS[stage])}
+
+    def __getitem__(self, name):
+        return self.array[self._index[name]]
+
+    def __setitem__(self, name, value):
+        self.array[self._index[name]] = value
+
+class CaptureStatus:
+    """The capture callback's status flags, handed to vad.audio_callback like sounddevice's."""
+
+    def __init__(self, flags):
+        self.input_overflow = bool(flags & INPUT_OVERFLOW)
+        self.input_underflow = bool(flags & INPUT_UNDERFLOW)
+
+    def __bool__(self):
+        return self.input_overflow or self.input_underflow
+
+    def __str__(self):
+        return ", ".join(name for name, on in (("input overflow", self.input_overflow),
+                                               ("input underflow", self.input_underflow)) if on)
+
+class CaptureClock:
+    """vad.py's `time` module in the VAD stage: time() is the capture time of the block being processed."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class RemoteSmartTurn:
+    """predict_endpoint for the VAD stage: asks the inference stage, one request at a time.
+
+    Returns the answer once it is back, `{"prediction": 0, "pending": True}`
+    until then. Answers to requests sent before the last speech frame are
+    dropped: the segment went on after the audio they judged.
+    """
+
+    def __init__(self, requests, results, clock, stats):
+        self._requests = requests
+        self._results = results
+        self._clock = clock
+        self._stats = stats
+        self.vad = None  # the vad module, for last_speech_time
+        self._next_id = 0
+        self._in_flight = None  # (id, sent at)
+        self._answer = None  # (sent at, result)
+
+    def predict_endpoint(self, audio_array):
+        self._poll()
+        if self._answer is not None:
+            sent_at, result = self._answer
+            self._answer = None
+            if self.vad.last_speech_time is None or sent_at >= self.vad.last_speech_time:
+                self._stats["answers"] += 1
+                return result
+            self._stats["stale"] += 1
+        if self._in_flight is None:
+            self._next_id += 1
+            self._in_flight = (self._next_id, self._clock.time())
+            samples = np.ascontiguousarray(audio_array, dtype = np.float32)
+            self._requests.write(KIND_BINARY, [REQUEST.pack(*self._in_flight), memoryview(samples).cast("B")])
+            self._stats["requests"] += 1
+        return {"prediction": 0, "probability": None, "pending": True}
+
+    def _poll(self):
+        for record in self._results.read():
+            request_id, prediction, probability, _ = RESULT.unpack(record)
+            if self._in_flight is not None and request_id == self._in_flight[0]:
+                self._answer = (self._in_flight[1], {"prediction": prediction, "probability": probability})
+                self._in_flight = None
+
+def audio_ring_size():
+    return int(AUDIO_RING_SECONDS * SAMPLE_RATE / HOP_SIZE) * (RECORD.size + BLOCK.size + 4 * HOP_SIZE + 8)
+
+def capture_stage(stats_array, ready, stop):
+    """The sounddevice stream: copies every block into the audio ring."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the orchestrator stops the stages in order
+    import sounddevice as sd
+
+    stats = StageStats(stats_array, "capture")
+    ring = RingWriter(AUDIO_RING, audio_ring_size())
+    seq = 0
+
+    def callback(indata, frames, t, status):
+        nonlocal seq
+        seq += 1
+        flags = (INPUT_OVERFLOW if status.input_overflow else 0) | (INPUT_UNDERFLOW if status.input_underflow else 0)
+        samples = np.ascontiguousarray(indata[:, 0])
+        ring.write(KIND_BINARY, [BLOCK.pack(seq, time.time(), flags), memoryview(samples).cast("B")])
+        stats["blocks"] += 1
+        stats["frames"] += frames
+        if status.input_overflow:
+            stats["overflows"] += 1
+
+    with sd.InputStream(callback = callback,
+                        channels = 1,
+                        samplerate = SAMPLE_RATE,
+                        blocksize = HOP_SIZE,
+                        dtype = "float32"):
+        ready.set()
+        while not stop.wait(1.0):
+            stats["cpu_s"] = time.process_time()
+    ring.close()
+
+def vad_stage(stats_array, ready, stop):
+    """vad.py's segmentation on the audio ring; Smart Turn is sent to the inference stage."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stats = StageStats(stats_array, "vad")
+    audio = RingReader(AUDIO_RING)
+    results = RingReader(RESULT_RING)
+    requests = RingWriter(REQUEST_RING, REQUEST_RING_SIZE)
+    clock = CaptureClock()
+    smart_turn = RemoteSmartTurn(requests, results, clock, stats)
+    # vad.py imports predict_endpoint from inference: here that is the client,
+    # so the model is only loaded in the inference stage
+    inference = types.ModuleType("inference")
+    inference.predict_endpoint = smart_turn.predict_endpoint
+    sys.modules["inference"] = inference
+    import vad
+    vad.time = clock
+    smart_turn.vad = vad
+    if vad.METRICS_PORT:
+        metrics.serve(vad.METRICS_PORT)
+    ready.set()
+
+    stream_time = StreamTime(0.0, 0.0, 0.0)
+    last_seq = None
+    while True:
+        records = audio.wait(timeout = 0.1, spin = 0, sleep = VAD_POLL_INTERVAL)
+        if not records:
+            if stop.is_set():
+                break  # capture has stopped and the ring is worked off
+            continue
+        for record in records:
+            seq, captured, flags = BLOCK.unpack_from(record)
+            if last_seq is not None and seq > last_seq + 1:
+                stats["lost_blocks"] += seq - last_seq - 1
+            last_seq = seq
+            indata = np.frombuffer(record, dtype = np.float32, offset = BLOCK.size).reshape(-1, 1)
+            clock.now = captured
+            started = time.perf_counter()
+            vad.audio_callback(indata, len(indata), stream_time, CaptureStatus(flags) if flags else None)
+            stats["busy_s"] += time.perf_counter() - started
+            stats["blocks"] += 1
+            stats["frames"] += len(indata)
+        lag = (time.time() - captured) * 1000.0
+        stats["lag_ms"] = lag
+        stats["lag_max_ms"] = max(stats["lag_max_ms"], lag)
+        stats["cpu_s"] = time.process_time()
+
+    vad.shutdown()
+    audio.close()
+    results.close()
+    requests.close()
+
+def inference_stage(stats_array, ready, stop):
+    """Loads the Smart Turn model and answers the VAD stage's requests in order."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stats = StageStats(stats_array, "inference")
+    requests = RingReader(REQUEST_RING)
+    results = RingWriter(RESULT_RING, RESULT_RING_SIZE)
+    from inference import predict_endpoint
+    ready.set()
+
+    while not stop.is_set():
+        for record in requests.wait(timeout = 0.5, spin = 0, sleep = INFERENCE_POLL_INTERVAL):
+            request_id, _ = REQUEST.unpack_from(record)
+            audio = np.frombuffer(record, dtype = np.float32, offset = REQUEST.size)
+            started = time.perf_counter()
+            result = predict_endpoint(audio)
+            seconds = time.perf_counter() - started
+            results.write(KIND_BINARY, [RESULT.pack(request_id, int(result["prediction"]),
+                                                    float(result["probability"]), seconds)])
+            stats["requests"] += 1
+            stats["busy_s"] += seconds
+            stats["last_ms"] = seconds * 1000.0
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000.0)
+        stats["cpu_s"] = time.process_time()
+    requests.close()
+    results.close()
+
+STAGES = (("inference", inference_stage), ("vad", vad_stage), ("capture", capture_stage))
+
+class PipelineReport:
+    """One line per interval: throughput and CPU of every stage from their shared counters."""
+
+    def __init__(self, stats):
+        self.stats = {name: StageStats(array, name) for name, array in stats.items()}
+        self._last = self._snapshot()
+
+    def _snapshot(self):
+        return time.perf_counter(), {name: list(s.array) for name, s in self.stats.items()}
+
+    def line(self):
+        (t0, before), (t1, after) = self._last, self._snapshot()
+        self._last = (t1, after)
+
+        def rate(stage, field):
+            i = STAGE_FIELDS[stage].index(field)
+            return (after[stage][i] - before[stage][i]) / (t1 - t0)
+
+        capture, vad, inference = self.stats["capture"], self.stats["vad"], self.stats["inference"]
+        overflows = f", {capture['overflows']:.0f} overflows" if capture["overflows"] else ""
+        return (f"📊 capture {rate('capture', 'blocks'):.1f} blocks/s, {rate('capture', 'cpu_s'):.0%} CPU{overflows} | "
+                f"VAD {rate('vad', 'frames') / SAMPLE_RATE:.2f}x realtime, busy {rate('vad', 'busy_s'):.0%}, "
+                f"{rate('vad', 'cpu_s'):.0%} CPU, lag {vad['lag_ms']:.1f} ms (max {vad['lag_max_ms']:.1f}), "
+                f"lost {vad['lost_blocks'] * HOP_SIZE / SAMPLE_RATE:.2f} s | "
+                f"inference {rate('inference', 'requests'):.2f}/s, last {inference['last_ms']:.0f} ms, "
+                f"max {inference['max_ms']:.0f} ms, {rate('inference', 'cpu_s'):.0%} CPU, "
+                f"{vad['stale']:.0f} stale answers")
+
+def main():
+    # a fresh interpreter per stage: PortAudio and onnxruntime do not survive a fork
+    ctx = mp.get_context("spawn")
+    # the rings exist before any stage starts, so every reader attaches before its writer writes
+    rings = [RingWriter(AUDIO_RING, audio_ring_size()), RingWriter(REQUEST_RING, REQUEST_RING_SIZE),
+             RingWriter(RESULT_RING, RESULT_RING_SIZE)]
+    stats = {name: ctx.Array("d", len(fields), lock = False) for name, fields in STAGE_FIELDS.items()}
+    for name, fields in STAGE_FIELDS.items():
+        for i, field in enumerate(fields):
+            kind = metrics.gauge if field in GAUGES else metrics.counter
+            kind(f"vad_pipeline_{name}_{field}", f"{name} stage: {field.replace('_', ' ')}",
+                 fn = lambda array = stats[name], i = i: array[i])
+    if PIPELINE_METRICS_PORT:
+        metrics.serve(PIPELINE_METRICS_PORT)
+
+    stops = {name: ctx.Event() for name, _ in STAGES}
+    processes = {}
+    try:
+        # consumers first: the inference stage, then VAD, then capture
+        for name, target in STAGES:
+            ready = ctx.Event()
+            process = ctx.Process(target = target, args = (stats[name], ready, stops[name]), name = f"vad-{name}")
+            process.start()
+            processes[name] = process
+            deadline = time.monotonic() + STAGE_START_TIMEOUT
+            while not ready.wait(0.5):
+                if not process.is_alive() or time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} stage did not start")
+            print(f"✅ {name} stage running (pid {process.pid})")
+        print("🎙️ TEN-VAD pipeline streaming... speak now! (Ctrl+C to stop)")
+        report = PipelineReport(stats)
+        while all(p.is_alive() for p in processes.values()):
+            time.sleep(STATS_INTERVAL)
+            print(report.line())
+        print(f"❌ Stage exited: {', '.join(n for n, p in processes.items() if not p.is_alive())}")
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped by user.")
+    except RuntimeError as e:
+        print(f"❌ {e}")
+    finally:
+        # in pipeline order, so the VAD stage sees all captured audio before it shuts down
+        for name in ("capture", "vad", "inference"):
+            if name in processes:
+                stops[name].set()
+                processes[name].join(timeout = 30)
+                if processes[name].is_alive():
+                    print(f"⚠️ {name} stage did not stop, terminating it")
+                    processes[name].terminate()
+        for ring in rings:
+            ring.close()
+            ring.unlink()
+    print("✅ Exiting.")
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,14 @@
-import asyncio
-import websockets
-import json
+"""The WebSocket hub, runnable from smart-turn-detection/: `python ws.py [options]`.
 
-# client side for websocket
+It is ws-client.py from the repo root (see its docstring for the options);
+this file only runs it, so there is one hub to maintain.
+"""
+import os
+import runpy
+import sys
 
-connected_clients = set()
-
-async def handler(websocket):
-    connected_clients.add(websocket)
-    print("🌐 Client connected")
-    try:
-        async for message in websocket:
-            print(f"📥 Received from client: {message}")
-            # Echo back to the client
-            await websocket.send(json.dumps({"echo": message}))
-    except websockets.exceptions.ConnectionClosed:
-        print("⚠️ Client disconnected")
-    finally:
-        connected_clients.remove(websocket)
-
-async def main():
-    print("WebSocket server listening on ws://localhost:8765")
-    async with websockets.serve(handler, "localhost", 8765):
-        await asyncio.Future()  # run forever
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    sys.path.insert(0, ROOT)
+    runpy.run_path(os.path.join(ROOT, "ws-client.py"), run_name = "__main__")
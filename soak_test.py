@@ -0,0 +1,298 @@
+"""Soak test: hours of replayed audio through a VAD script, watching for growth and drift.
+
+    python soak_test.py ten_vad_segmentation.py --hours 4                  # synthetic speech, as fast as possible
+    python soak_test.py smart-turn-detection/vad.py speech.wav --hours 24 --sample-every 300
+    python soak_test.py ten_vad_segmentation.py --hours 2 --limit rss_mb=2 --limit segment_times=0
+
+A WAV file (or `--loop` seconds of synthetic speech) is replayed over and
+over through the script's audio_callback on replay.py's virtual clock, so
+hours of audio take minutes at the default `--speed 0`, and segments, merges
+and retention behave as they would in a session that long. After every
+`--sample-every` seconds of audio the test records:
+
+    rss_mb              resident memory of the process (/proc, Linux)
+    gc_objects          objects tracked by the garbage collector, after a collection
+    threads, open_fds   threads alive and file descriptors open
+    callback_*_ms       p50 / p99 / max time per callback in that window
+    over_budget         callbacks in that window slower than their block
+    io_queue_depth      jobs waiting for the I/O worker; io_dropped: frames it dropped so far
+    publisher_pending   events queued in the script's publisher (with --publish)
+    segment_times, current_audio, pending_group     sizes of the script's own containers
+
+Samples after the first `--warmup` of the run (a fraction) get a line per
+series, fitted robustly (Theil-Sen: the median slope over all pairs of
+samples, so a sample that happens to land on a burst such as a merge does
+not tilt it), and a slope per hour of audio above its limit fails the test
+(exit 1). LIMITS holds the defaults; `--limit series=value` overrides
+them or adds one. Series without a limit are reported only: segment_times
+(and with it timestamps.json) holds one entry per segment and merge by
+design. On failure the object types that grew most since the warmup are
+printed, and with `--tracemalloc` the lines that allocated what is still
+alive from after the warmup (tracemalloc slows every allocation down, so
+callback times are not comparable with such runs). Results go to soak_results/<script>_<time>/: soak.json (samples,
+slopes, verdicts, type growth) and samples.csv for plotting; the script's
+files are written there too, its console output is discarded unless
+`--console-log`.
+"""
+import argparse
+import csv
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from replay import (SAMPLE_RATE, Pacer, RecordingPublisher, Timings, VirtualClock, drive_callback, load_audio,
+                    load_script, sounddevice_stub, virtualize)
+from synthetic_audio import speech_stream
+
+# slope limit per hour of audio
+LIMITS = {
+    "rss_mb": 5.0,
+    "gc_objects": 5000,
+    "threads": 0.5,
+    "open_fds": 0.5,
+    "callback_p99_ms": 0.1,
+    "io_queue_depth": 50,
+    "io_dropped": 0,
+    "publisher_pending": 50,
+}
+CONTAINERS = ("segment_times", "current_audio", "pending_group")
+
+class CountingPublisher(RecordingPublisher):
+    """RecordingPublisher that only counts events, so hours of them do not grow the test itself."""
+
+    def __init__(self, clock, forward = None):
+        super().__init__(clock, forward)
+        self.counts = Counter()
+
+    def record(self, event_type, payload):
+        self.counts[event_type] += 1
+        self.sent_events += 1
+
+    def stats(self):
+        stats = {"events": dict(self.counts), "audio_frames": self.audio_frames}
+        if self.forward is not None:
+            stats["forwarded"] = self.forward.stats()
+        return stats
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        return float("nan")  # not Linux
+
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return float("nan")
+
+def type_census():
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+def looped(audio, pos, n):
+    """`n` samples of `audio` from `pos` on, wrapping around (slices, no index array)."""
+    parts = []
+    while n:
+        part = audio[pos:pos + n]
+        parts.append(part)
+        n -= len(part)
+        pos = 0
+    return np.concatenate(parts)
+
+def take_sample(module, publisher, clock, timings, started):
+    gc.collect()
+    t = timings.summary()
+    sample = {
+        "audio_h": clock.elapsed / 3600.0,
+        "wall_s": time.perf_counter() - started,
+        "rss_mb": rss_mb(),
+        "gc_objects": len(gc.get_objects()),
+        "threads": threading.active_count(),
+        "open_fds": open_fds(),
+        "callback_p50_ms": t["p50_ms"],
+        "callback_p99_ms": t["p99_ms"],
+        "callback_max_ms": t["max_ms"],
+        "over_budget": t["over_budget"],
+        "publisher_pending": publisher.pending(),
+    }
+    if hasattr(module, "_io"):
+        io_stats = module._io.stats()
+        sample["io_queue_depth"] = io_stats["queue_depth"]
+        sample["io_dropped"] = io_stats["dropped"]
+    for name in CONTAINERS:
+        if hasattr(module, name):
+            sample[name] = len(getattr(module, name))
+    return sample
+
+def theil_sen(x, y, max_points = 2000):
+    """Median slope over all pairs of points: a sample that lands on a burst does not tilt it."""
+    if len(x) > max_points:
+        keep = np.linspace(0, len(x) - 1, max_points).astype(int)
+        x, y = x[keep], y[keep]
+    i, j = np.triu_indices(len(x), 1)
+    dx = x[j] - x[i]
+    return float(np.median((y[j] - y[i])[dx > 0] / dx[dx > 0]))
+
+def fit(samples, limits):
+    """Slope per hour of audio of every series over `samples`, and whether it is within its limit."""
+    hours = np.array([s["audio_h"] for s in samples])
+    out = {}
+    for name in samples[0]:
+        if name in ("audio_h", "wall_s"):
+            continue
+        values = np.array([s.get(name, np.nan) for s in samples], dtype = float)
+        if len(samples) < 3 or np.isnan(values).any() or np.ptp(hours) == 0:
+            continue
+        slope = round(theil_sen(hours, values), 6)
+        limit = limits.get(name)
+        out[name] = {
+            "slope_per_h": slope,
+            "first": float(values[0]),
+            "last": float(values[-1]),
+            "limit_per_h": limit,
+            "ok": None if limit is None else slope <= limit,
+        }
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", help = "VAD script with an audio_callback")
+    parser.add_argument("wav", nargs = "?", help = f"{SAMPLE_RATE} Hz 16-bit WAV to loop (default: synthetic speech)")
+    parser.add_argument("--hours", type = float, default = 1.0, help = "hours of audio to replay")
+    parser.add_argument("--loop", type = float, default = 600, help = "seconds of synthetic speech to loop")
+    parser.add_argument("--sample-every", type = float, default = 60, help = "seconds of audio between samples")
+    parser.add_argument("--warmup", type = float, default = 0.2, help = "fraction of the run left out of the fits")
+    parser.add_argument("--limit", action = "append", default = [], metavar = "SERIES=PER_HOUR",
+                        help = "slope limit per hour of audio (repeatable)")
+    parser.add_argument("--speed", type = float, default = 0, help = "x real time; 0: as fast as possible")
+    parser.add_argument("--blocksize", help = "frames per callback, or a comma-separated list (see replay.py)")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--out", help = "output directory (default: soak_results/<script>_<time>)")
+    parser.add_argument("--publish", action = "store_true", help = "also publish events through the script's transport")
+    parser.add_argument("--tracemalloc", action = "store_true",
+                        help = "trace allocations after the warmup and list where the growth was allocated")
+    parser.add_argument("--console-log", action = "store_true", help = "keep the script's output in console.log")
+    args = parser.parse_args()
+
+    limits = dict(LIMITS)
+    for item in args.limit:
+        name, _, value = item.partition("=")
+        limits[name] = float(value)
+
+    script = os.path.abspath(args.script)
+    if args.wav:
+        audio = load_audio(args.wav)
+    else:
+        audio = speech_stream(args.loop, args.seed)[:int(args.loop * SAMPLE_RATE)]
+    out = os.path.abspath(args.out or os.path.join(
+        "soak_results", f"{os.path.splitext(os.path.basename(script))[0]}_{time.strftime('%Y%m%d_%H%M%S')}"))
+    os.makedirs(out, exist_ok = True)
+    sys.modules["sounddevice"] = sounddevice_stub()
+    sys.path.insert(0, os.path.dirname(script))
+
+    clock = VirtualClock(round(time.time()))
+    pacer = Pacer(args.speed)
+    cwd = os.getcwd()
+    os.chdir(out)
+    console = open("console.log" if args.console_log else os.devnull, "w")
+    report = sys.stdout  # the script's threads print at any time, so all of it goes to `console`
+    with redirect_stdout(console):
+        module = load_script(script)
+        if not hasattr(module, "audio_callback"):
+            raise SystemExit(f"{args.script} has no audio_callback to soak")
+        publisher = CountingPublisher(clock, forward = getattr(module, "_publisher", None) if args.publish else None)
+        timers = virtualize(module, clock, publisher)
+        blocksizes = [int(b) for b in args.blocksize.split(",")] if args.blocksize else [module.HOP_SIZE]
+        window = int(args.sample_every * SAMPLE_RATE) // max(blocksizes) * max(blocksizes)
+        total = args.hours * 3600.0
+        print(f"🧪 Soaking {args.script} with {total / 3600:.1f} h of audio "
+              f"({len(audio) / SAMPLE_RATE:.0f} s looped), a sample every {args.sample_every:g} s → {out}/",
+              file = report)
+
+        samples = []
+        census = None
+        started = time.perf_counter()
+        pos = 0
+        while clock.elapsed < total:
+            timings = Timings()
+            chunk = looped(audio, pos, window)
+            pos = (pos + window) % len(audio)
+            drive_callback(module, chunk, blocksizes, pacer, clock, timers, timings, args.seed + len(samples))
+            del chunk  # the test's own buffers must not show up in the RSS samples
+            samples.append(take_sample(module, publisher, clock, timings, started))
+            if census is None and clock.elapsed >= args.warmup * total:
+                census = type_census()
+                if args.tracemalloc:
+                    tracemalloc.start(8)
+            s = samples[-1]
+            print(f"⏳ {s['audio_h']:.2f} h audio, {s['wall_s']:.0f} s wall: RSS {s['rss_mb']:.1f} MB, "
+                  f"{s['gc_objects']} objects, callback p99 {s['callback_p99_ms']:.3f} ms, "
+                  f"I/O queue {s.get('io_queue_depth', 0)}", file = report, flush = True)
+
+        if hasattr(module, "shutdown"):
+            module.shutdown()
+    console.close()
+
+    fitted = [s for s in samples if s["audio_h"] * 3600.0 >= args.warmup * total]
+    slopes = fit(fitted, limits) if fitted else {}
+    failed = [name for name, r in slopes.items() if r["ok"] is False]
+    growth = []
+    sites = []
+    if census is not None:
+        gc.collect()
+        growth = [(name, n) for name, n in (type_census() - census).most_common(15)]
+    if tracemalloc.is_tracing():
+        # everything traced is still alive and was allocated after the warmup
+        sites = [str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:15]]
+        tracemalloc.stop()
+
+    print(f"\n{'series':<20}{'first':>12}{'last':>12}{'slope/h':>14}{'limit/h':>12}")
+    for name, r in slopes.items():
+        limit = "" if r["limit_per_h"] is None else f"{r['limit_per_h']:g}"
+        verdict = {True: "✅", False: "❌", None: ""}[r["ok"]]
+        print(f"{name:<20}{r['first']:>12.2f}{r['last']:>12.2f}{r['slope_per_h']:>14.3f}{limit:>12} {verdict}")
+    if failed and growth:
+        print("\nObject types that grew most since the warmup:")
+        for name, n in growth:
+            print(f"  +{n:<10} {name}")
+    if failed and sites:
+        print("\nStill allocated from after the warmup, by line:")
+        for site in sites:
+            print(f"  {site}")
+
+    result = {
+        "script": args.script,
+        "input": args.wav or f"synthetic {args.loop:g} s, seed {args.seed}",
+        "params": {k: v for k, v in vars(args).items() if k not in ("script", "wav", "out")},
+        "audio_h": clock.elapsed / 3600.0,
+        "wall_s": time.perf_counter() - started,
+        "events": publisher.stats(),
+        "slopes": slopes,
+        "failed": failed,
+        "type_growth": dict(growth),
+        "allocation_sites": sites,
+        "samples": samples,
+    }
+    with open("soak.json", "w") as f:
+        json.dump(result, f, indent = 4)
+    with open("samples.csv", "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = list(dict.fromkeys(k for s in samples for k in s)))
+        writer.writeheader()
+        writer.writerows(samples)
+    os.chdir(cwd)
+    print(f"\n{'❌ Failed: ' + ', '.join(failed) if failed else '✅ Within all limits'} "
+          f"({result['audio_h']:.1f} h of audio in {result['wall_s']:.0f} s)")
+    print(f"📝 Results written to {os.path.join(out, 'soak.json')} and samples.csv")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+from ten_vad import TenVad
+
+class StreamSegmenter:
+    """TEN-VAD segmentation of one audio stream that arrives in chunks (e.g. over a WebSocket).
+
+    The same state machine as `audio_callback` in ten_vad_segmentation.py:
+    speech opens a segment, `silence_timeout` seconds of silence close it, and
+    segments closing less than `merge_window` seconds apart share one group
+    file, which is moved to `merge_dir` once the window closes. All times are
+    positions in the stream (samples / sample_rate), not wall-clock time, so
+    the result does not depend on how fast or bursty the chunks arrive and no
+    timer threads are needed.
+
+    `feed()` must be called from one thread at a time. `emit(event_type,
+    payload)` is called from the feeding thread and from the I/O thread (for
+    events sent once files are durable).
+    """
+
+    def __init__(self, wav_writer, raw_dir, merge_dir, emit, sample_rate = 16000, hop_size = 256,
+                 threshold = 0.7, silence_timeout = 1.0, merge_window = 2.0):
+        os.makedirs(raw_dir, exist_ok = True)
+        os.makedirs(merge_dir, exist_ok = True)
+        self.raw_dir = raw_dir
+        self.merge_dir = merge_dir
+        self.sample_rate = sample_rate
+        self.hop_size = hop_size
+        self.samples_fed = 0
+        self.segment_index = 0
+        self.is_recording = False
+        self._vad = TenVad(hop_size = hop_size, threshold = threshold)
+        self._writer = wav_writer
+        self._emit = emit
+        self._silence_samples = int(silence_timeout * sample_rate)
+        self._merge_samples = int(merge_window * sample_rate)
+        self._carry = np.empty(0, dtype = np.int16)  # partial hop left over from the last chunk
+        self._last_speech = None
+        self._segment_start = None  # stream position of the open segment
+        self._segment_start_sample = None  # its offset in the group file
+        self._segment_start_dropped = None
+        self._group = []
+        self._group_sink = None
+        self._close_at = None  # stream position where the merge window ends
+
+    def feed(self, pcm):
+        """Segment int16 samples of any length; hop-sized slices of `pcm` go to disk as they are."""
+        if len(self._carry):
+            pcm = np.concatenate((self._carry, pcm))
+        n = len(pcm) - len(pcm) % self.hop_size
+        self._carry = pcm[n:].copy()
+        for start in range(0, n, self.hop_size):
+            self._process(pcm[start:start + self.hop_size])
+
+    def close(self):
+        """End of stream: close the open segment and finalize its group."""
+        if self.is_recording:
+            self._close_segment()
+        self._finalize()
+
+    def _seconds(self, position):
+        return position / self.sample_rate
+
+    def _process(self, frame):
+        if self._close_at is not None and self.samples_fed >= self._close_at:
+            self._finalize()
+        self.samples_fed += len(frame)
+        prob, flag = self._vad.process(frame)
+        if flag == 1:
+            if not self.is_recording:
+                self._start_segment()
+            self._last_speech = self.samples_fed
+        if self.is_recording:
+            self._group_sink.write(frame)
+            if flag != 1 and self.samples_fed - self._last_speech > self._silence_samples:
+                self._close_segment()
+
+    def _start_segment(self):
+        self.is_recording = True
+        self._segment_start = self.samples_fed - self.hop_size
+        self._close_at = None  # resumed speech keeps the group open
+        if self._group_sink is None:
+            # the group file is named after its first segment
+            self._group_sink = self._writer.open(
+                os.path.join(self.raw_dir, f"segment_{self.segment_index + 1}.wav"), self.sample_rate)
+        self._segment_start_sample = self._group_sink.samples_queued
+        self._segment_start_dropped = self._group_sink.samples_dropped
+        self._emit("speech_start", {
+            "segment": self.segment_index + 1,
+            "timestamp": self._seconds(self._segment_start),
+        })
+
+    def _close_segment(self):
+        self.is_recording = False
+        self.segment_index += 1
+        start, end = self._seconds(self._segment_start), self._seconds(self.samples_fed)
+        saved = {
+            "segment": self.segment_index,
+            "file": os.path.basename(self._group_sink.path),  # the group file, at start/end_sample
+            "start": start,
+            "end": end,
+            "duration": end - start,
+            "start_sample": self._segment_start_sample,
+            "end_sample": self._group_sink.samples_queued,
+        }
+        dropped = self._group_sink.samples_dropped - self._segment_start_dropped
+        if dropped:
+            saved["dropped_samples"] = dropped  # missing from the file
+        self._group.append(saved)
+        self._close_at = self.samples_fed + self._merge_samples
+
+        # sent once the segment's audio is durable on disk
+        def _on_synced(error):
+            if error is None:
+                self._emit("segment_saved", saved)
+        self._group_sink.sync(on_done = _on_synced)
+
+    def _finalize(self):
+        group, sink = self._group, self._group_sink
+        self._group, self._group_sink, self._close_at = [], None, None
+        if sink is None:
+            return
+        if len(group) <= 1:
+            sink.close()  # a single segment stays in raw_dir
+            return
+        merged_name = os.path.join(
+            self.merge_dir, "+".join(f"segment_{s['segment']}" for s in group) + ".wav")
+        merged = {
+            "merged_file": os.path.basename(merged_name),
+            "parts": [f"segment_{s['segment']}.wav" for s in group],
+            "start": group[0]["start"],
+            "end": group[-1]["end"],
+            "duration": group[-1]["end"] - group[0]["start"],
+            "start_sample": group[0]["start_sample"],
+            "end_sample": group[-1]["end_sample"],
+        }
+
+        def _on_merged(error):
+            if error is None:
+                self._emit("merged", merged)
+        sink.close(final_path = merged_name, on_done = _on_merged)
@@ -0,0 +1,27 @@
+"""Speech-like 16 kHz int16 test audio for the benchmarks, load test, replay and soak test."""
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+def synthetic_clip(seconds, seed):
+    """Speech-like test signal: a few harmonics under a syllable-rate envelope plus noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 120 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    audio = 0.3 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+def speech_stream(seconds, seed):
+    """Utterances of 0.5-3 s separated by 1.5-4 s of low noise, as int16 PCM."""
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0
+    while total < seconds * SAMPLE_RATE:
+        speech = synthetic_clip(rng.uniform(0.5, 3.0), int(rng.integers(1 << 30)))
+        pause = (rng.standard_normal(int(rng.uniform(1.5, 4.0) * SAMPLE_RATE)) * 30).astype(np.int16)
+        parts += [speech, pause]
+        total += len(speech) + len(pause)
+    return np.concatenate(parts)
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import time
+
+from io_worker import IOWorker
+
+class TimestampLog:
+    """Append-only JSONL log of segment_times updates, written by an IOWorker thread.
+
+    Every `append()` becomes one `{"name": ..., "entry": ...}` line in `log_path`.
+    Every `compact_interval` seconds (and on close) the full view is written to
+    `summary_path` in the same format `timestamps.json` always had, and the log
+    is truncated. Use `load_segment_times()` to rebuild the current view.
+    """
+
+    def __init__(self, summary_path, log_path = None, compact_interval = 60.0, io = None):
+        self.summary_path = summary_path
+        self.log_path = log_path or os.path.splitext(summary_path)[0] + ".jsonl"
+        self.compact_interval = compact_interval
+        self._owns_io = io is None
+        self._io = io or IOWorker(name = "timestamp-log")
+        self._view = {}
+        self._log = None
+        self._dirty = False
+        self._last_compact = time.monotonic()
+        # every session starts from an empty summary, like the old full rewrite did
+        self._io.submit(self._compact, droppable = False)
+
+    def append(self, name, entry, on_done = None):
+        """Queue one segment_times update (non-blocking); `on_done(error)` fires once it is on disk."""
+        self._io.submit(self._append, name, entry, on_done = on_done, droppable = False)
+
+    def close(self, timeout = 5):
+        """Write everything queued so far and compact."""
+        self._io.submit(self._close, droppable = False)
+        if self._owns_io:
+            self._io.stop(timeout = timeout)
+        else:
+            self._io.flush(timeout = timeout)
+
+    def _append(self, name, entry):
+        self._view[name] = entry
+        self._dirty = True
+        self._log.write(json.dumps({"name": name, "entry": entry}) + "\n")
+        self._log.flush()
+        if time.monotonic() - self._last_compact >= self.compact_interval:
+            self._compact()
+
+    def _close(self):
+        if self._dirty:
+            self._compact()
+        self._log.close()
+
+    def _compact(self):
+        """Write the full view to summary_path, then start a fresh log."""
+        tmp_path = self.summary_path + ".tmp"
+        self._last_compact = time.monotonic()
+        try:
+            with open(tmp_path, "w", encoding = "utf-8") as f:
+                json.dump(self._view, f, indent = 4)
+            os.replace(tmp_path, self.summary_path)
+        except Exception as e:
+            # keep appending to the old log, it still holds everything
+            print("⚠️ Failed to compact timestamps:", e)
+            if self._log is not None:
+                return
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, "w", encoding = "utf-8")
+        self._dirty = False
+
+def load_segment_times(summary_path = "timestamps.json", log_path = None):
+    """Rebuild the current segment_times view: the compacted summary plus the log tail."""
+    log_path = log_path or os.path.splitext(summary_path)[0] + ".jsonl"
+    segment_times = {}
+    if os.path.exists(summary_path):
+        with open(summary_path, encoding = "utf-8") as f:
+            segment_times.update(json.load(f))
+    if os.path.exists(log_path):
+        with open(log_path, encoding = "utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn last line from a crash
+                segment_times[record["name"]] = record["entry"]
+    return segment_times
+
+if __name__ == "__main__":
+    # python timestamp_log.py [timestamps.json] -> print the current view
+    path = sys.argv[1] if len(sys.argv) > 1 else "timestamps.json"
+    print(json.dumps(load_segment_times(path), indent = 4))
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""Per-stage latency of traced VAD events (run the VAD script with TRACE_EVENTS = True).
+
+    python trace_report.py                                   # subscribe to the hub at ws://localhost:8765
+    python trace_report.py --url ws://localhost:8765 --stream mic-1 --seconds 60 --json trace.json
+    python trace_report.py --shm vad-events                  # follow the shared-memory ring instead
+
+Every received event's trace (see ws_protocol.TRACE_STAGES) is stamped
+`recv` and split into the time between consecutive stages it passed, e.g.
+vad→disk for a segment_saved is the wait for the audio sync. The
+histograms per event type and stage are printed every `--interval` seconds
+and on exit (Ctrl+C or `--seconds`). Stamps are time.monotonic(), so this
+must run on the host that produced the events. `seq` gaps (events lost on
+the way) and repeats are counted per stream.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+from ws_protocol import TRACE_STAGES, FrameCodec, subprotocols
+from ws_publisher import LatencyHistogram
+
+# microseconds (in-process stages) up to seconds (merge windows, reconnects)
+BUCKETS_MS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+class StageLatencies:
+    """Histograms of stage-to-stage latency, per event type."""
+
+    def __init__(self):
+        self.histograms = {}  # (event type, "a→b") -> LatencyHistogram
+        self.untraced = 0
+        self.last_seq = {}  # stream -> highest seq seen
+        self.gaps = 0
+        self.repeats = 0
+
+    def add(self, stream, event, recv):
+        seq = event.get("seq")
+        if seq is not None:
+            last = self.last_seq.get(stream)
+            if last is not None and seq <= last:
+                self.repeats += 1
+            elif last is not None and seq > last + 1:
+                self.gaps += seq - last - 1
+            self.last_seq[stream] = max(seq, last or 0)
+        trace = event.get("trace")
+        if not trace:
+            self.untraced += 1
+            return
+        trace["recv"] = recv
+        stages = [s for s in TRACE_STAGES if s in trace]
+        for a, b in zip(stages, stages[1:]):
+            self._observe(event["event"], f"{a}→{b}", trace[b] - trace[a])
+        self._observe(event["event"], f"total {stages[0]}→recv", recv - trace[stages[0]])
+
+    def _observe(self, event_type, stage, seconds):
+        key = (event_type, stage)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram(BUCKETS_MS)
+        self.histograms[key].observe(seconds * 1000.0)
+
+    def summary(self):
+        out = {}
+        for (event_type, stage), h in self.histograms.items():
+            out.setdefault(event_type, {})[stage] = dict(h.summary(), p90_ms = h.percentile(0.9))
+        return {
+            "stages": out,
+            "untraced": self.untraced,
+            "seq_gaps": self.gaps,
+            "seq_repeats": self.repeats,
+        }
+
+    def print_table(self):
+        print(f"{'event':<15}{'stage':<24}{'count':>7}{'avg ms':>10}{'p50 ms':>10}{'p90 ms':>10}"
+              f"{'p99 ms':>10}{'max ms':>10}")
+        for event_type, stages in self.summary()["stages"].items():
+            # the pipeline's order, totals last
+            order = sorted(stages, key = lambda s: (s.startswith("total"), TRACE_STAGES.index(s.split("→")[0].split()[-1])))
+            for stage in order:
+                s = stages[stage]
+                print(f"{event_type:<15}{stage:<24}{s['count']:>7}{s['avg_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+                      f"{s['p90_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}")
+        print(f"untraced events: {self.untraced}, seq gaps: {self.gaps}, seq repeats: {self.repeats}")
+
+async def follow_ws(url, latencies):
+    codec = FrameCodec()
+    while True:
+        try:
+            async with websockets.connect(url, subprotocols = subprotocols()) as ws:
+                codec.set_subprotocol(ws.subprotocol)
+                print(f"🌐 Subscribed to {url}")
+                async for message in ws:
+                    recv = time.monotonic()
+                    frame = codec.decode(message)
+                    for event in frame.get("events", ()):
+                        latencies.add(frame.get("stream"), event, recv)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            print("⚠️ WS connection error:", e)
+            await asyncio.sleep(2)
+
+async def follow_shm(name, latencies):
+    from shm_events import RingReader
+    reader = RingReader(name)
+    codec = FrameCodec()
+    print(f"📡 Following {name}")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # short blocking waits on a worker thread keep the loop free for the report timer
+            for message in await loop.run_in_executor(None, reader.wait, 0.5):
+                recv = time.monotonic()
+                frame = codec.decode(message)
+                for event in frame.get("events", ()):
+                    latencies.add(frame.get("stream"), event, recv)
+    finally:
+        reader.close()
+
+async def run(args, latencies):
+    if args.shm:
+        source = follow_shm(args.shm, latencies)
+    else:
+        query = f"?stream={args.stream}" if args.stream else ""
+        source = follow_ws(f"{args.url.rstrip('/')}/subscribe{query}", latencies)
+    task = asyncio.get_running_loop().create_task(source)
+    started = time.monotonic()
+    while not task.done():
+        await asyncio.sleep(min(args.interval, args.seconds or args.interval))
+        if args.seconds and time.monotonic() - started >= args.seconds:
+            break
+        latencies.print_table()
+    task.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default = "ws://localhost:8765", help = "hub to subscribe to")
+    parser.add_argument("--stream", help = "only this stream (STREAM_ID)")
+    parser.add_argument("--shm", help = "follow this shared-memory ring (SHM_NAME) instead of the hub")
+    parser.add_argument("--interval", type = float, default = 10, help = "seconds between reports")
+    parser.add_argument("--seconds", type = float, help = "stop after this long (default: until Ctrl+C)")
+    parser.add_argument("--json", help = "also write the final summary to this file")
+    args = parser.parse_args()
+
+    latencies = StageLatencies()
+    try:
+        asyncio.run(run(args, latencies))
+    except KeyboardInterrupt:
+        print()
+    latencies.print_table()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(latencies.summary(), f, indent = 4, ensure_ascii = False)
+        print(f"📝 Summary written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import struct
+import time
+
+from io_worker import IOWorker
+
+WAV_HEADER_SIZE = 44
+HEADER_PATCH_INTERVAL = 0.5  # seconds between header updates while a file is open
+
+def wav_header(data_bytes, sample_rate, channels = 1, sampwidth = 2):
+    """Canonical 44-byte PCM WAV header for `data_bytes` of sample data."""
+    block_align = channels * sampwidth
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sampwidth * 8,
+        b"data", data_bytes,
+    )
+
+class WavSink:
+    """Handle to one WAV file that is being streamed to disk by a WavWriter.
+
+    `write()`, `sync()` and `close()` only enqueue work on the I/O worker, so
+    they are safe to call from the audio callback. Frames must not be modified
+    after they are written. `samples_queued` counts the frames the worker
+    accepted, so it is the file's length once they are written; frames
+    dropped on a full queue are counted in `samples_dropped` instead.
+    """
+
+    def __init__(self, io, path, sample_rate):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.samples_queued = 0
+        self.samples_dropped = 0
+        self._io = io
+        self._file = None
+        self._data_bytes = 0
+        self._last_patch = 0.0
+
+    def write(self, frame):
+        """Queue `frame` for the file; returns False if the full I/O queue dropped it."""
+        if not self._io.submit(self._write, frame):
+            self.samples_dropped += len(frame)
+            return False
+        self.samples_queued += len(frame)
+        return True
+
+    def sync(self, on_done = None):
+        """Make everything written so far durable; `on_done(error)` fires afterwards."""
+        self._io.submit(self._sync, on_done = on_done, droppable = False)
+
+    def close(self, final_path = None, on_done = None):
+        """Patch the header, close the file and optionally rename it to `final_path`.
+
+        `on_done(error)` is called from the I/O thread once the file is final.
+        """
+        self._io.submit(self._close, final_path, on_done = on_done, droppable = False)
+
+    def _open(self):
+        self._file = open(self.path, "wb")
+        self._file.write(wav_header(0, self.sample_rate))
+
+    def _write(self, frame):
+        if self._file is None:
+            return  # open failed and was already reported
+        self._file.write(frame.tobytes())
+        self._data_bytes += frame.nbytes
+        # keep the header current, so a crash still leaves a playable file
+        if time.monotonic() - self._last_patch >= HEADER_PATCH_INTERVAL:
+            self._patch_header()
+
+    def _sync(self):
+        if self._file is None:
+            raise OSError(f"{self.path} is not open")
+        self._patch_header()
+        os.fsync(self._file.fileno())
+
+    def _close(self, final_path):
+        if self._file is None:
+            raise OSError(f"{self.path} is not open")
+        self._sync()
+        self._file.close()
+        self._file = None
+        if final_path and final_path != self.path:
+            os.replace(self.path, final_path)
+            self.path = final_path
+
+    def _patch_header(self):
+        f = self._file
+        f.seek(0)
+        f.write(wav_header(self._data_bytes, self.sample_rate))
+        f.seek(0, os.SEEK_END)
+        f.flush()
+        self._last_patch = time.monotonic()
+
+class WavWriter:
+    """Opens WavSinks whose frames are appended by an IOWorker thread.
+
+    Frames are appended as they arrive and the RIFF/data sizes are patched every
+    HEADER_PATCH_INTERVAL, so a crash mid-utterance still leaves a playable
+    partial file. Pass a shared `io` worker to order WAV writes with the rest
+    of the pipeline's file I/O.
+    """
+
+    def __init__(self, io = None):
+        self._owns_io = io is None
+        self.io = io or IOWorker(name = "wav-writer")
+
+    def open(self, path, sample_rate):
+        sink = WavSink(self.io, path, sample_rate)
+        self.io.submit(sink._open, droppable = False)
+        return sink
+
+    def stop(self, timeout = 5):
+        """Drain everything queued so far (and stop the worker if we own it)."""
+        if self._owns_io:
+            self.io.stop(timeout = timeout)
+        else:
+            self.io.flush(timeout = timeout)
\ No newline at end of file
@@ -1,28 +1,440 @@
+"""Fan-out WebSocket hub for VAD events.
+
+    python ws-client.py [--host localhost] [--port 8765] [--queue 256] [--sndbuf 65536] [--quiet]
+
+Producers (the VAD scripts) connect to any path and publish event frames and
+live audio; they name their stream with an `X-Stream-Id` header. Events from
+a producer that sends `X-Publisher-Id` carry sequence numbers: after each
+frame the hub acks the highest one it has published, and it drops events it
+has already published from that publisher, so events a producer replays
+after a reconnect reach subscribers once. A publisher's sequence is kept
+for PUBLISHER_TTL seconds after it was last seen (and for at most
+MAX_PUBLISHERS publishers), so producers that restart with a new id do not
+pile up in a long-running hub. Subscribers connect to
+`/subscribe` and may filter server-side:
+
+    ws://localhost:8765/subscribe?stream=mic-1,mic-2&events=segment_saved,merged,audio&slow=disconnect
+
+`stream` / `events` default to everything ("audio" selects live audio frames,
+which do not name their stream, so subscribe to one stream to use them).
+Each subscriber has a bounded send queue; when it is full the oldest queued
+message is dropped (`slow=skip`, default) or the subscriber is disconnected
+(`slow=disconnect`), so one slow consumer never holds up the others. The
+kernel send buffer of subscriber sockets is capped (`--sndbuf`) so slow
+consumers show up in the queue instead of hiding in megabytes of socket
+buffer per connection.
+
+Clients can also stream raw 16 kHz int16 little-endian PCM (binary messages
+of any length) to `/ingest?stream=NAME` and have it segmented here: each
+connection gets its own TEN-VAD segmenter, run on a shared thread pool, and
+its speech_start / segment_saved / merged events are sent back on the same
+connection (and published to subscribers of its stream). Segment files go to
+`--ingest-dir/<stream>_<date>_<time>_<n>/`. Each connection has at most one
+chunk in processing; while it waits, the server stops reading from it once
+a few messages are buffered, so a client cannot send faster than its audio
+is segmented. At most `--max-sessions` connections are segmented at once;
+further ones are closed with 1013 (try again later).
+"""
+import argparse
 import asyncio
 import websockets
 import json
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
 
-# client side for websocket
+import numpy as np
 
-connected_clients = set()
+from io_worker import IOWorker
+from wav_sink import WavWriter
+from ws_protocol import ENCODINGS, FrameCodec, select_subprotocol, subprotocols
 
-async def handler(websocket):
-    connected_clients.add(websocket)
-    print("🌐 Client connected")
+STATS_INTERVAL = 10  # seconds between hub stats lines
+PUBLISHER_TTL = 3600  # seconds a publisher's last seq outlives its last frame, for dedup across reconnects
+MAX_PUBLISHERS = 10000  # the least recently seen publishers are forgotten beyond this
+
+class Subscriber:
+    """One subscriber connection: its filters and bounded send queue."""
+
+    def __init__(self, websocket, streams, events, slow, max_queue):
+        self.websocket = websocket
+        self.streams = streams  # None = all
+        self.events = events  # None = all; frozenset, so equal filters share encoded frames
+        self.slow = slow
+        self.max_queue = max_queue
+        self.encoding = ENCODINGS.get(websocket.subprotocol, "json")
+        self.audio = websocket.subprotocol is not None and (events is None or "audio" in events)
+        self.sent = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._closing = False
+
+    def offer(self, message):
+        """Queue `message` without blocking; a full queue drops the oldest or disconnects."""
+        if self._closing:
+            return
+        if len(self._queue) >= self.max_queue:
+            if self.slow == "disconnect":
+                self._closing = True
+                hub.slow_disconnects += 1
+                asyncio.get_running_loop().create_task(self.websocket.close(1008, "slow consumer"))
+                return
+            self._queue.popleft()
+            self.dropped += 1
+            hub.dropped += 1
+        self._queue.append(message)
+        self._ready.set()
+
+    async def run(self):
+        try:
+            while True:
+                while self._queue:
+                    await self.websocket.send(self._queue.popleft())
+                    self.sent += 1
+                self._ready.clear()
+                await self._ready.wait()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+class Hub:
+    """Routes producer frames to subscribers by stream and event type."""
+
+    def __init__(self, max_queue, sndbuf = None, quiet = False):
+        self.max_queue = max_queue
+        self.sndbuf = sndbuf
+        self.quiet = quiet
+        self.producers = 0
+        self.subscribers = 0
+        self.by_stream = {}  # stream id -> subscribers of that stream
+        self.everything = set()  # subscribers without a stream filter
+        self.codecs = {}  # encoding -> outbound codec shared by all subscribers (for stats)
+        # X-Publisher-Id -> (highest seq published, last seen), least recently seen first;
+        # kept across that publisher's reconnects until it expires
+        self.last_seq = OrderedDict()
+        self.publishers_expired = 0
+        self.frames_in = 0
+        self.duplicates = 0
+        self.messages_out = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+
+    def add(self, sub):
+        self.subscribers += 1
+        if sub.streams is None:
+            self.everything.add(sub)
+        else:
+            for stream in sub.streams:
+                self.by_stream.setdefault(stream, set()).add(sub)
+
+    def remove(self, sub):
+        self.subscribers -= 1
+        self.everything.discard(sub)
+        for stream in sub.streams or ():
+            self.by_stream.get(stream, set()).discard(sub)
+
+    def publish(self, stream, frame, raw):
+        """Fan `frame` (decoded from the producer's `raw` message) out to every matching subscriber."""
+        self.frames_in += 1
+        targets = list(self.everything)
+        targets.extend(self.by_stream.get(stream, ()))
+        if "audio" in frame:
+            # forwarded as received, there is nothing to re-encode
+            for sub in targets:
+                if sub.audio:
+                    sub.offer(raw)
+                    self.messages_out += 1
+            return
+        if not self.quiet:
+            for event in frame["events"]:
+                print(f"📥 {stream}: {json.dumps(event)}")
+        # encode once per (encoding, event filter), not once per subscriber
+        encoded = {}
+        for sub in targets:
+            key = (sub.encoding, sub.events)
+            if key not in encoded:
+                events = frame["events"]
+                if sub.events is not None:
+                    events = [e for e in events if e["event"] in sub.events]
+                encoded[key] = self._codec(sub.encoding).encode(
+                    {"stream": stream, "sent_at": frame.get("sent_at"), "events": events}) if events else None
+            if encoded[key] is not None:
+                sub.offer(encoded[key])
+                self.messages_out += 1
+
+    def expire_publishers(self):
+        """Forget publishers not seen for PUBLISHER_TTL seconds, and the oldest beyond MAX_PUBLISHERS."""
+        cutoff = time.monotonic() - PUBLISHER_TTL
+        while self.last_seq:
+            publisher, (_, seen) = next(iter(self.last_seq.items()))
+            if seen > cutoff and len(self.last_seq) <= MAX_PUBLISHERS:
+                break
+            del self.last_seq[publisher]
+            self.publishers_expired += 1
+
+    def stats(self):
+        return {
+            "producers": self.producers,
+            "publishers": len(self.last_seq),
+            "publishers_expired": self.publishers_expired,
+            "subscribers": self.subscribers,
+            "frames_in": self.frames_in,
+            "duplicates": self.duplicates,
+            "messages_out": self.messages_out,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+    def _codec(self, encoding):
+        if encoding not in self.codecs:
+            self.codecs[encoding] = FrameCodec(next(p for p, e in ENCODINGS.items() if e == encoding))
+        return self.codecs[encoding]
+
+class Ingest:
+    """Shared resources of the /ingest sessions: segmenter thread pool, file I/O and admission."""
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, max_sessions, workers, out_dir):
+        # TEN-VAD is only needed when ingestion is enabled
+        from stream_segmenter import StreamSegmenter
+        self.segmenter = StreamSegmenter
+        self.max_sessions = max_sessions
+        self.out_dir = out_dir
+        # TenVad.process runs in native code, so sessions segment in parallel on these threads
+        self.pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "ingest")
+        self.io = IOWorker(name = "ingest-io")
+        self.wav_writer = WavWriter(io = self.io)
+        self.active = 0
+        self.sessions = 0
+        self.rejected = 0
+        self.audio_s = 0.0
+        self.busy_s = 0.0
+        self._stats_lock = threading.Lock()
+
+    def feed(self, segmenter, samples):
+        """Runs on the pool; keeps track of how much faster than real time segmentation runs."""
+        t0 = time.perf_counter()
+        segmenter.feed(samples)
+        with self._stats_lock:
+            self.busy_s += time.perf_counter() - t0
+            self.audio_s += len(samples) / self.SAMPLE_RATE
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "sessions": self.sessions,
+            "rejected": self.rejected,
+            "audio_s": round(self.audio_s, 1),
+            "x_realtime": round(self.audio_s / self.busy_s, 1) if self.busy_s else 0.0,
+            "io": self.io.stats(),
+        }
+
+    def stop(self):
+        self.pool.shutdown(wait = True)
+        self.wav_writer.stop()
+        self.io.stop()
+
+hub = None
+ingest = None
+
+def _csv(params, name):
+    values = params.get(name)
+    return frozenset(v for value in values for v in value.split(",") if v) if values else None
+
+def _dedup(publisher, frame):
+    """Drop events of `frame` already published for `publisher`; returns the seq to ack (None = no acks)."""
+    last, _ = hub.last_seq.pop(publisher, (0, None))
+    events = [e for e in frame["events"] if e.get("seq") is None or e["seq"] > last]
+    hub.duplicates += len(frame["events"]) - len(events)
+    frame["events"] = events
+    last = max([last] + [e["seq"] for e in events if e.get("seq") is not None])
+    hub.last_seq[publisher] = (last, time.monotonic())  # now the most recently seen
+    hub.expire_publishers()
+    return last
+
+def _check_frame(frame):
+    """Raise ValueError unless the decoded `frame` is audio or events the hub can route."""
+    if "audio" in frame:
+        return
+    if "events" not in frame:
+        raise ValueError("neither events nor audio")
+    for event in frame["events"]:
+        if not isinstance(event.get("event"), str):
+            raise ValueError("event without a name")
+        if event.get("seq") is not None and not isinstance(event["seq"], int):
+            raise ValueError(f"seq {event['seq']!r} is not an integer")
+        if "trace" in event and not isinstance(event["trace"], dict):
+            raise ValueError("trace is not an object")
+
+async def producer(websocket):
+    stream = websocket.request.headers.get("X-Stream-Id", "default")
+    publisher = websocket.request.headers.get("X-Publisher-Id")
+    codec = FrameCodec(websocket.subprotocol)
+    hub.producers += 1
+    print(f"🎙️ Producer connected: {stream} ({codec.encoding})")
     try:
         async for message in websocket:
-            print(f"📥 Received from client: {message}")
-            # Echo back to the client
-            await websocket.send(json.dumps({"echo": message}))
+            try:
+                frame = codec.decode(message)
+                _check_frame(frame)
+            except ValueError as e:
+                print(f"⚠️ Undecodable message from {stream}: {e}")
+                continue
+            ack = _dedup(publisher, frame) if publisher is not None and "events" in frame else None
+            for event in frame.get("events", ()):
+                if "trace" in event:
+                    event["trace"]["hub"] = time.monotonic()
+            if "audio" in frame or frame["events"]:  # nothing is left of a frame of replays already published
+                hub.publish(stream, frame, message)
+            if ack is not None:
+                await websocket.send(codec.encode({"ack": ack}))
     except websockets.exceptions.ConnectionClosed:
-        print("⚠️ Client disconnected")
+        print(f"⚠️ Producer {stream} disconnected")
     finally:
-        connected_clients.remove(websocket)
+        hub.producers -= 1
+        print(f"📊 {stream} decoded: {codec.stats()}")
+
+async def subscriber(websocket, params):
+    slow = params.get("slow", ["skip"])[0]
+    if slow not in ("skip", "disconnect"):
+        await websocket.close(1008, "slow must be skip or disconnect")
+        return
+    if hub.sndbuf:
+        websocket.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, hub.sndbuf)
+    sub = Subscriber(websocket, _csv(params, "stream"), _csv(params, "events"), slow, hub.max_queue)
+    hub.add(sub)
+    if not hub.quiet:
+        print(f"🌐 Subscriber connected ({sub.encoding}, streams={sorted(sub.streams or ['*'])}, "
+              f"events={sorted(sub.events or ['*'])})")
+    sender = asyncio.get_running_loop().create_task(sub.run())
+    try:
+        # subscribers are not expected to send anything; read (and ignore) until closed
+        async for _ in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        sender.cancel()
+        hub.remove(sub)
+        if not hub.quiet:
+            print(f"⚠️ Subscriber disconnected (sent {sub.sent}, dropped {sub.dropped})")
+
+async def ingest_session(websocket, params):
+    if ingest is None or ingest.active >= ingest.max_sessions:
+        if ingest is not None:
+            ingest.rejected += 1
+        await websocket.close(1013, "ingest disabled" if ingest is None else "ingest at capacity")
+        return
+    if int(params.get("sample_rate", [Ingest.SAMPLE_RATE])[0]) != Ingest.SAMPLE_RATE:
+        await websocket.close(1003, f"only {Ingest.SAMPLE_RATE} Hz audio is supported")
+        return
+    ingest.sessions += 1
+    stream = params.get("stream", [websocket.request.headers.get("X-Stream-Id", "ingest")])[0]
+    stream = re.sub(r"[^A-Za-z0-9_.-]", "_", stream)
+    session_dir = os.path.join(ingest.out_dir, f"{stream}_{time.strftime('%Y%m%d_%H%M%S')}_{ingest.sessions}")
+    loop = asyncio.get_running_loop()
+    codec = FrameCodec(websocket.subprotocol)
+    # events back to the client go through the same bounded queue as a subscriber's
+    reply = Subscriber(websocket, None, None, "skip", hub.max_queue)
+    sender = loop.create_task(reply.run())
+    ingest.active += 1  # released in the finally below, however the session ends
+    print(f"🎧 Ingest session {stream} started ({ingest.active}/{ingest.max_sessions})")
+
+    def deliver(event_type, payload):
+        frame = {"sent_at": time.time(), "events": [{"event": event_type, "data": payload}]}
+        reply.offer(codec.encode(dict(frame)))
+        hub.publish(stream, frame, None)
+
+    def emit(event_type, payload):
+        # called from the pool or the I/O thread
+        loop.call_soon_threadsafe(deliver, event_type, payload)
+
+    segmenter = None
+    try:
+        # inside the try: a segmenter that fails to start (makedirs, TenVad) still frees the slot
+        segmenter = await loop.run_in_executor(ingest.pool, lambda: ingest.segmenter(
+            ingest.wav_writer, session_dir, os.path.join(session_dir, "merged"), emit))
+        async for message in websocket:
+            if isinstance(message, str):
+                continue  # control messages are not defined yet
+            samples = np.frombuffer(message, dtype = "<i2", count = len(message) // 2)
+            # one chunk in flight per session; meanwhile websockets stops reading
+            # this connection once its receive queue is full (TCP backpressure)
+            await loop.run_in_executor(ingest.pool, ingest.feed, segmenter, samples)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        sender.cancel()
+        try:
+            if segmenter is not None:
+                await loop.run_in_executor(ingest.pool, segmenter.close)
+        finally:
+            ingest.active -= 1
+        if segmenter is None:
+            print(f"⚠️ Ingest session {stream} failed to start")
+        else:
+            print(f"🎧 Ingest session {stream} ended ({segmenter.samples_fed / Ingest.SAMPLE_RATE:.1f}s of audio, "
+                  f"{segmenter.segment_index} segments)")
+
+async def handler(websocket):
+    url = urlsplit(websocket.request.path)
+    if url.path.rstrip("/") == "/subscribe":
+        await subscriber(websocket, parse_qs(url.query))
+    elif url.path.rstrip("/") == "/ingest":
+        await ingest_session(websocket, parse_qs(url.query))
+    else:
+        await producer(websocket)
+
+async def report():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        hub.expire_publishers()  # also when no producer is sending
+        print(f"📊 Hub: {hub.stats()}")
+        if ingest is not None:
+            print(f"📊 Ingest: {ingest.stats()}")
 
 async def main():
-    print("WebSocket server listening on ws://localhost:8765")
-    async with websockets.serve(handler, "localhost", 8765):
-        await asyncio.Future()  # run forever
+    global hub, ingest
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default = "localhost")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--queue", type = int, default = 256, help = "per-subscriber send queue, in messages")
+    parser.add_argument("--sndbuf", type = int, default = 65536,
+                        help = "kernel send buffer of subscriber sockets, in bytes (0 = system default)")
+    parser.add_argument("--quiet", action = "store_true", help = "do not print events and subscribers")
+    parser.add_argument("--max-sessions", type = int, default = 16,
+                        help = "concurrent /ingest sessions (0 disables ingestion)")
+    parser.add_argument("--ingest-workers", type = int, default = os.cpu_count(),
+                        help = "segmenter threads shared by all ingest sessions")
+    parser.add_argument("--ingest-dir", default = "ingest", help = "where ingest sessions write their segments")
+    args = parser.parse_args()
+
+    hub = Hub(args.queue, sndbuf = args.sndbuf, quiet = args.quiet)
+    if args.max_sessions > 0:
+        try:
+            ingest = Ingest(args.max_sessions, args.ingest_workers, args.ingest_dir)
+        except ImportError as e:
+            print(f"⚠️ Ingest disabled: {e}")
+    print(f"WebSocket hub listening on ws://{args.host}:{args.port} (encodings: {', '.join(subprotocols())})")
+    async with websockets.serve(handler, args.host, args.port, subprotocols = subprotocols(),
+                                select_subprotocol = select_subprotocol):
+        reporter = asyncio.get_running_loop().create_task(report())
+        try:
+            await asyncio.Future()  # run forever
+        finally:
+            reporter.cancel()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print(f"\n📊 Hub: {hub.stats()}")
+        if ingest is not None:
+            ingest.stop()
+            print(f"📊 Ingest: {ingest.stats()}")
@@ -0,0 +1,501 @@
+"""Load generator and latency benchmark for the WebSocket hub (ws-client.py), all on localhost.
+
+    python ws_loadtest.py                                        # fanout: 1000 subscribers, 4 producers
+    python ws_loadtest.py --mode segmenters --clients 200 --audio
+    python ws_loadtest.py --mode pcm --clients 16 --seconds 60
+    python ws_loadtest.py --url ws://localhost:8765 --server-pid 1234    # against a hub that is already running
+
+Modes:
+    fanout       producers publish batched event frames at a fixed rate to many
+                 subscribers on three filters (everything / segment_saved+merged /
+                 one stream); `--slow` of them read one message per second.
+    segmenters   `--clients` simulated VAD scripts publish realistic event mixes
+                 (speech_start, segment_saved after 0.5-3 s of speech, sometimes
+                 merged, a stats event every 10 s, optionally live audio) while
+                 `--subscribers` monitors receive everything.
+    pcm          `--clients` stream speech-like 16 kHz PCM in real time to /ingest
+                 and wait for the hub's events; latency is measured from sending
+                 a segment's last sample to receiving its segment_saved.
+
+Event latency is sent_at -> received on the same host. The hub's CPU and RSS
+are sampled from /proc (Linux) when the hub is started here or `--server-pid`
+is given. Results are printed and written to `<out>.json` and `<out>.md`.
+In fanout mode, even with small socket buffers a slow subscriber absorbs a
+few hundred KB before the hub's queue for it fills, so use runs of tens of
+seconds to see the slow-consumer handling.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+from array import array
+from urllib.parse import urlsplit
+
+import numpy as np
+import websockets
+
+from synthetic_audio import speech_stream, synthetic_clip
+from ws_protocol import FrameCodec, subprotocols
+
+SAMPLE_RATE = 16000
+HOP_SIZE = 256
+
+EVENT_MIX = ("speech_start", "segment_saved", "speech_start", "segment_saved", "merged", "stats")
+FILTERS = (
+    ("all", ""),
+    ("saved+merged", "events=segment_saved,merged"),
+    ("one stream", "stream=load-0"),
+)
+MONITOR_EVENTS = "events=speech_start,segment_saved,merged,stats"
+
+class Results:
+    def __init__(self):
+        self.sent = {}  # (stream, event) -> events published
+        self.received = {name: 0 for name, _ in FILTERS}
+        self.latency_ms = {name: array("d") for name, _ in FILTERS}
+        self.subscribers = {name: 0 for name, _ in FILTERS}
+        self.slow_received = 0
+        self.connect_failures = 0
+        self.dropped_connections = 0  # closed by the server (or the network) during the run
+        self.audio_frames = 0
+        self.segments = 0
+
+    def count(self, stream, event):
+        self.sent[(stream, event)] = self.sent.get((stream, event), 0) + 1
+
+    def expected(self, name):
+        if name == "all":
+            return sum(self.sent.values())
+        if name == "saved+merged":
+            return sum(n for (_, e), n in self.sent.items() if e in ("segment_saved", "merged"))
+        return sum(n for (s, _), n in self.sent.items() if s == "load-0")
+
+def percentiles(values):
+    lat = np.frombuffer(values) if len(values) else np.zeros(1)
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p90_ms": float(np.percentile(lat, 90)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "max_ms": float(lat.max()),
+    }
+
+class ServerMonitor:
+    """Samples CPU and RSS of the hub process from /proc once per `interval`."""
+
+    def __init__(self, pid, interval = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_pct = []
+        self.rss_mb = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks  # utime + stime
+
+    def _rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    async def run(self):
+        try:
+            last_cpu, last_t = self._cpu_seconds(), time.perf_counter()
+            while True:
+                await asyncio.sleep(self.interval)
+                cpu, t = self._cpu_seconds(), time.perf_counter()
+                self.cpu_pct.append(100.0 * (cpu - last_cpu) / (t - last_t))
+                self.rss_mb.append(self._rss_mb())
+                last_cpu, last_t = cpu, t
+        except OSError:
+            return  # not Linux, or the process is gone
+
+    def summary(self):
+        if not self.cpu_pct:
+            return None
+        return {
+            "cpu_pct_avg": sum(self.cpu_pct) / len(self.cpu_pct),
+            "cpu_pct_max": max(self.cpu_pct),
+            "rss_mb_avg": sum(self.rss_mb) / len(self.rss_mb),
+            "rss_mb_max": max(self.rss_mb),
+        }
+
+# ---- fanout ---------------------------------------------------------------
+
+async def producer(url, stream, rate, batch, stop, results):
+    codec = FrameCodec()
+    async with websockets.connect(url, subprotocols = subprotocols(),
+                                  additional_headers = {"X-Stream-Id": stream}) as ws:
+        codec.set_subprotocol(ws.subprotocol)
+        n = 0
+        next_send = time.perf_counter()
+        while not stop.is_set():
+            events = []
+            for _ in range(batch):
+                event = EVENT_MIX[n % len(EVENT_MIX)]
+                events.append({"event": event, "data": {"segment": n, "duration": 1.5}})
+                results.count(stream, event)
+                n += 1
+            await ws.send(codec.encode({"sent_at": time.time(), "events": events}))
+            next_send += 1.0 / rate
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+async def subscriber(url, name, query, ready, results):
+    codec = FrameCodec()
+    connected = False
+    try:
+        async with websockets.connect(f"{url}/subscribe?{query}", subprotocols = subprotocols(),
+                                      open_timeout = 30) as ws:
+            codec.set_subprotocol(ws.subprotocol)
+            results.subscribers[name] += 1
+            connected = True
+            ready.release()
+            latencies = results.latency_ms[name]
+            async for message in ws:
+                now = time.time()
+                frame = codec.decode(message)
+                if "events" in frame:
+                    results.received[name] += len(frame["events"])
+                    latencies.append((now - frame["sent_at"]) * 1000.0)
+            results.dropped_connections += 1  # closed by the server before the end of the run
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+        results.connect_failures += 1
+        ready.release()
+    except websockets.exceptions.ConnectionClosed:
+        if connected:
+            results.dropped_connections += 1
+
+async def slow_subscriber(url, slow, ready, results):
+    # a tiny receive buffer, so backpressure reaches the hub after a few KB rather than megabytes
+    host, port = urlsplit(url).hostname, urlsplit(url).port
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, (host, port))
+        async with websockets.connect(f"{url}/subscribe?slow={slow}", subprotocols = subprotocols(),
+                                      open_timeout = 30, max_queue = 1, sock = sock) as ws:
+            ready.release()
+            while True:
+                await ws.recv()
+                results.slow_received += 1
+                await asyncio.sleep(1.0)
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+        results.connect_failures += 1
+        ready.release()
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def connect_subscribers(url, specs, results):
+    """Start one subscriber task per (name, query), name None = slow; handshakes go 100 at a time."""
+    ready = asyncio.Semaphore(0)
+    tasks = []
+    for i, (name, query) in enumerate(specs):
+        if name is None:
+            tasks.append(asyncio.create_task(slow_subscriber(url, query, ready, results)))
+        else:
+            tasks.append(asyncio.create_task(subscriber(url, name, query, ready, results)))
+        if i % 100 == 99:
+            for _ in range(100):
+                await ready.acquire()
+    for _ in range(len(specs) % 100):
+        await ready.acquire()
+    return tasks
+
+async def run_fanout(args, url, results):
+    specs = [FILTERS[i % len(FILTERS)] for i in range(args.subscribers)]
+    specs += [(None, "skip" if i % 2 == 0 else "disconnect") for i in range(args.slow)]
+    tasks = await connect_subscribers(url, specs, results)
+    print(f"🌐 {sum(results.subscribers.values())} subscribers + {args.slow} slow connected "
+          f"({results.connect_failures} failed)")
+    stop = asyncio.Event()
+    producers = [asyncio.create_task(producer(url, f"load-{i}", args.rate, args.batch, stop, results))
+                 for i in range(args.producers)]
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*producers)
+    return tasks
+
+# ---- segmenters -----------------------------------------------------------
+
+async def segmenter_client(url, stream, args, stop, results):
+    """Publishes what one VAD script would: utterances with pauses, optionally with live audio."""
+    rng = random.Random(stream)
+    codec = FrameCodec()
+    try:
+        async with websockets.connect(url, subprotocols = subprotocols(), open_timeout = 30,
+                                      additional_headers = {"X-Stream-Id": stream}) as ws:
+            codec.set_subprotocol(ws.subprotocol)
+
+            async def send(event, data):
+                await ws.send(codec.encode({"sent_at": time.time(), "events": [{"event": event, "data": data}]}))
+                results.count(stream, event)
+
+            segment = 0
+            last_stats = time.monotonic()
+            merge_group = []
+            while not stop.is_set():
+                await asyncio.sleep(rng.expovariate(1.0 / args.pause))
+                segment += 1
+                start = time.time()
+                await send("speech_start", {"segment": segment, "timestamp": start})
+                speech = rng.uniform(0.5, 3.0)
+                if args.audio:
+                    frame = synthetic_clip(HOP_SIZE / SAMPLE_RATE, segment)
+                    for k in range(int(speech * SAMPLE_RATE / HOP_SIZE)):
+                        await ws.send(codec.encode_audio(segment, k * HOP_SIZE, frame))
+                        results.audio_frames += 1
+                        await asyncio.sleep(HOP_SIZE / SAMPLE_RATE)
+                else:
+                    await asyncio.sleep(speech)
+                await send("segment_saved", {
+                    "segment": segment, "file": f"segment_{segment}.wav", "start": start,
+                    "end": start + speech, "duration": speech,
+                    "start_sample": 0, "end_sample": int(speech * SAMPLE_RATE)})
+                merge_group.append(f"segment_{segment}.wav")
+                if rng.random() < 0.6:  # the next utterance does not join this group
+                    if len(merge_group) > 1:
+                        await send("merged", {"merged_file": "+".join(merge_group), "parts": merge_group})
+                    merge_group = []
+                if time.monotonic() - last_stats >= 10:
+                    await send("stats", {"queue_depth": 0, "sent_events": segment})
+                    last_stats = time.monotonic()
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+        results.connect_failures += 1
+    except websockets.exceptions.ConnectionClosed:
+        results.dropped_connections += 1
+
+async def run_segmenters(args, url, results):
+    tasks = await connect_subscribers(url, [("all", MONITOR_EVENTS)] * args.subscribers, results)
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(segmenter_client(url, f"load-{i}", args, stop, results))
+               for i in range(args.clients)]
+    print(f"🎙️ {args.clients} segmenter clients, {results.subscribers['all']} monitors")
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*clients)
+    return tasks
+
+# ---- pcm ------------------------------------------------------------------
+
+async def pcm_client(url, i, args, stop, results):
+    stream = f"pcm-{i}"
+    audio = speech_stream(args.seconds + 10, i)
+    chunk = int(args.chunk_ms * SAMPLE_RATE / 1000)
+    sent_at = array("d")  # wall time each chunk went out
+    codec = FrameCodec()
+    latencies = results.latency_ms["all"]
+
+    async def read(ws):
+        async for message in ws:
+            now = time.time()
+            for event in codec.decode(message).get("events", ()):
+                results.received["all"] += 1
+                if event["event"] == "segment_saved":
+                    # the segment ends at this stream position; its last sample went out in this chunk
+                    last = max(0, int(round(event["data"]["end"] * SAMPLE_RATE)) - 1) // chunk
+                    if last < len(sent_at):
+                        latencies.append((now - sent_at[last]) * 1000.0)
+                    results.segments += 1
+
+    try:
+        async with websockets.connect(f"{url}/ingest?stream={stream}", subprotocols = subprotocols(),
+                                      open_timeout = 30) as ws:
+            codec.set_subprotocol(ws.subprotocol)
+            results.subscribers["all"] += 1
+            reader = asyncio.create_task(read(ws))
+            next_send = time.perf_counter()
+            for start in range(0, len(audio), chunk):
+                if stop.is_set():
+                    break
+                sent_at.append(time.time())
+                await ws.send(audio[start:start + chunk].tobytes())
+                next_send += chunk / SAMPLE_RATE
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+            await asyncio.sleep(args.drain)
+            reader.cancel()
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+        results.connect_failures += 1
+    except websockets.exceptions.ConnectionClosed as e:
+        # 1013 = turned away by the hub's max-sessions limit
+        if e.rcvd is not None and e.rcvd.code == 1013:
+            results.connect_failures += 1
+        else:
+            results.dropped_connections += 1
+
+async def run_pcm(args, url, results):
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(pcm_client(url, i, args, stop, results)) for i in range(args.clients)]
+    print(f"🎧 {args.clients} PCM clients streaming in real time")
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*clients)
+    return []
+
+# ---- driver ---------------------------------------------------------------
+
+def start_hub(args):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    cmd = [sys.executable, "-u", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ws-client.py"),
+           "--port", str(port), "--queue", str(args.queue), "--quiet",
+           "--max-sessions", str(args.clients if args.mode == "pcm" else 0)]
+    hub = subprocess.Popen(cmd, stdout = subprocess.PIPE, text = True)
+    hub.stdout.readline()  # "listening on ..."
+    return hub, f"ws://localhost:{port}"
+
+def stop_hub(hub):
+    """Stop the hub and return its final stats lines."""
+    hub.send_signal(signal.SIGINT)
+    out, _ = hub.communicate(timeout = 30)
+    stats = {}
+    for line in out.splitlines():
+        for key, prefix in (("hub", "📊 Hub:"), ("ingest", "📊 Ingest:")):
+            if line.startswith(prefix):
+                stats[key] = ast.literal_eval(line[len(prefix):].strip())
+    return stats
+
+async def run(args, url, server_pid):
+    results = Results()
+    monitor = ServerMonitor(server_pid) if server_pid else None
+    sampler = asyncio.create_task(monitor.run()) if monitor else None
+    scenario = {"fanout": run_fanout, "segmenters": run_segmenters, "pcm": run_pcm}[args.mode]
+    t0 = time.perf_counter()
+    tasks = await scenario(args, url, results)
+    elapsed = time.perf_counter() - t0
+    await asyncio.sleep(args.drain)  # let queued messages arrive
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions = True)
+    if sampler:
+        sampler.cancel()
+    return results, elapsed, monitor.summary() if monitor else None
+
+def summarize(args, results, elapsed, server, hub_stats):
+    sent = sum(results.sent.values())
+    summary = {
+        "mode": args.mode,
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "url", "server_pid")},
+        "duration_s": elapsed,
+        "events_sent": sent,
+        "events_per_s": sent / elapsed if elapsed else 0.0,
+        "connections": {
+            "failed": results.connect_failures,
+            "dropped": results.dropped_connections,
+        },
+        "server": server,
+        "hub": hub_stats,
+    }
+    if args.mode == "pcm":
+        # events come from the hub here, so count what was received
+        summary["events_sent"] = results.received["all"]
+        summary["events_per_s"] = results.received["all"] / elapsed if elapsed else 0.0
+        summary["audio_s"] = results.subscribers["all"] * elapsed
+        summary["segments"] = results.segments
+        summary["latency"] = {"segment_saved": percentiles(results.latency_ms["all"])}
+        return summary
+    summary["latency"] = {}
+    summary["delivery"] = {}
+    for name, _ in FILTERS:
+        subs = results.subscribers[name]
+        if subs:
+            expected = results.expected(name) * subs
+            summary["latency"][name] = percentiles(results.latency_ms[name])
+            summary["delivery"][name] = results.received[name] / expected if expected else 0.0
+    if args.mode == "fanout":
+        summary["slow_received"] = results.slow_received
+    if args.audio:
+        summary["audio_frames_sent"] = results.audio_frames
+    return summary
+
+def markdown(summary):
+    lines = [f"# WS load test: {summary['mode']}", "", f"Run at {time.strftime('%Y-%m-%d %H:%M:%S')}", "",
+             "| parameter | value |", "|---|---|"]
+    lines += [f"| {k} | {v} |" for k, v in summary["params"].items()]
+    lines += ["", "| latency | count | p50 ms | p90 ms | p99 ms | max ms | delivered |",
+              "|---|---|---|---|---|---|---|"]
+    for name, p in summary["latency"].items():
+        delivered = summary.get("delivery", {}).get(name)
+        lines.append(f"| {name} | {p['count']} | {p['p50_ms']:.1f} | {p['p90_ms']:.1f} | {p['p99_ms']:.1f} "
+                     f"| {p['max_ms']:.1f} | {'' if delivered is None else f'{delivered:.1%}'} |")
+    events = "events received" if summary["mode"] == "pcm" else "events sent"
+    lines += ["", "| metric | value |", "|---|---|",
+              f"| {events} | {summary['events_sent']} ({summary['events_per_s']:.0f}/s) |",
+              f"| connections failed | {summary['connections']['failed']} |",
+              f"| connections dropped | {summary['connections']['dropped']} |"]
+    for key in ("segments", "audio_s", "audio_frames_sent", "slow_received"):
+        if key in summary:
+            lines.append(f"| {key.replace('_', ' ')} | {summary[key]:.0f} |")
+    server = summary["server"]
+    if server:
+        lines += [f"| server CPU % (avg / max) | {server['cpu_pct_avg']:.0f} / {server['cpu_pct_max']:.0f} |",
+                  f"| server RSS MB (avg / max) | {server['rss_mb_avg']:.0f} / {server['rss_mb_max']:.0f} |"]
+    for key, stats in (summary["hub"] or {}).items():
+        lines.append(f"| {key} | {', '.join(f'{k}={v}' for k, v in stats.items() if not isinstance(v, dict))} |")
+    return "\n".join(lines) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices = ("fanout", "segmenters", "pcm"), default = "fanout")
+    parser.add_argument("--url", help = "hub to test (default: start one on a free port)")
+    parser.add_argument("--server-pid", type = int, help = "pid of the hub at --url, to sample its CPU/RSS")
+    parser.add_argument("--seconds", type = float, default = 10)
+    parser.add_argument("--drain", type = float, default = 2, help = "seconds to wait for delivery after the run")
+    parser.add_argument("--queue", type = int, default = 256, help = "per-subscriber queue of the started hub")
+    parser.add_argument("--subscribers", type = int,
+                        help = "subscribers (fanout, default 1000) or monitors (segmenters, default 4)")
+    parser.add_argument("--out", help = "results path without extension (default: loadtest_results/<mode>_<time>)")
+    fanout = parser.add_argument_group("fanout")
+    fanout.add_argument("--slow", type = int, default = 10, help = "subscribers reading one message per second")
+    fanout.add_argument("--producers", type = int, default = 4)
+    fanout.add_argument("--rate", type = float, default = 50, help = "frames per second per producer")
+    fanout.add_argument("--batch", type = int, default = 4, help = "events per frame")
+    clients = parser.add_argument_group("segmenters / pcm")
+    clients.add_argument("--clients", type = int, default = 100, help = "simulated segmenter or PCM clients")
+    clients.add_argument("--pause", type = float, default = 2.0, help = "mean pause between utterances, seconds")
+    clients.add_argument("--audio", action = "store_true", help = "segmenters also stream live audio frames")
+    clients.add_argument("--chunk-ms", type = float, default = 20, help = "PCM chunk length")
+    args = parser.parse_args()
+    if args.subscribers is None:
+        args.subscribers = 1000 if args.mode == "fanout" else 4
+
+    # every connection is a file descriptor on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    hub = None
+    url, server_pid = args.url, args.server_pid
+    if url is None:
+        hub, url = start_hub(args)
+        server_pid = hub.pid
+    try:
+        results, elapsed, server = asyncio.run(run(args, url, server_pid))
+    finally:
+        hub_stats = stop_hub(hub) if hub is not None else None
+    summary = summarize(args, results, elapsed, server, hub_stats)
+
+    out = args.out or os.path.join("loadtest_results", f"{args.mode}_{time.strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok = True)
+    with open(out + ".json", "w") as f:
+        json.dump(summary, f, indent = 4)
+    report = markdown(summary)
+    with open(out + ".md", "w") as f:
+        f.write(report)
+    print("\n" + report)
+    print(f"📝 Results written to {out}.json and {out}.md")
+
+if __name__ == "__main__":
+    main()
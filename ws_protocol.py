@@ -0,0 +1,189 @@
+"""Wire format of the VAD event stream.
+
+A frame is `{"v": PROTOCOL_VERSION, "sent_at": ..., "events": [{"event", "data", "seq"}, ...]}`.
+`seq` numbers a publisher's events; the server answers with `{"v": ..., "ack": seq}`
+frames once everything up to `seq` has been handled (see ws_publisher).
+With tracing on, an event also carries `"trace": {stage: time.monotonic() seconds}`
+for the TRACE_STAGES it went through (see trace_report.py); stamps from
+different hosts are not comparable.
+The encoding is negotiated with the WebSocket subprotocol during the handshake:
+
+    vad-events.msgpack.v1   binary frames: version byte, FRAME_EVENTS byte, then the MessagePack frame
+    vad-events.json.v1      text frames: the JSON frame
+
+With either encoding, live segment audio (if enabled) is sent as binary
+AUDIO_HEADER + int16 little-endian samples frames. A peer that offers no
+subprotocol (or a server that picks none) gets JSON and no audio.
+MessagePack needs `pip install msgpack`; without it only JSON is offered.
+"""
+import json
+import struct
+import time
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PROTOCOL_VERSION = 1
+
+# second byte of every binary frame
+FRAME_EVENTS = 0
+FRAME_AUDIO = 1
+
+# version, FRAME_AUDIO, segment number, sample offset of the first sample within the segment
+AUDIO_HEADER = struct.Struct("<BBIQ")
+
+# pipeline stages an event can be stamped at, in the order it passes them
+TRACE_STAGES = (
+    "capture",     # ADC time of the audio frame that triggered the event
+    "callback",    # audio callback started
+    "vad",         # TEN-VAD decision for that frame
+    "smart_turn",  # Smart Turn prediction finished
+    "timer",       # merge window deadline fired
+    "disk",        # audio synced / file renamed on the I/O thread
+    "publish",     # handed to the publisher
+    "dequeue",     # taken from the publisher queue
+    "send",        # encoded and written to the socket / ring
+    "hub",         # forwarded by ws-client.py
+    "recv",        # received by the consumer
+)
+
+MSGPACK_SUBPROTOCOL = f"vad-events.msgpack.v{PROTOCOL_VERSION}"
+JSON_SUBPROTOCOL = f"vad-events.json.v{PROTOCOL_VERSION}"
+
+ENCODINGS = {
+    MSGPACK_SUBPROTOCOL: "msgpack",
+    JSON_SUBPROTOCOL: "json",
+}
+
+def subprotocols():
+    """Subprotocols this side supports, preferred first."""
+    return [p for p in ENCODINGS if ENCODINGS[p] != "msgpack" or msgpack is not None]
+
+def select_subprotocol(connection, offered):
+    """`websockets.serve(select_subprotocol=...)` hook: best common encoding, None (JSON) otherwise."""
+    for p in subprotocols():
+        if p in offered:
+            return p
+    return None
+
+class FrameCodec:
+    """Encodes/decodes frames in one encoding and measures what that costs.
+
+    CPU time is thread CPU time spent inside encode/decode, so it does not
+    include waiting on the socket.
+    """
+
+    def __init__(self, subprotocol = None):
+        self.set_subprotocol(subprotocol)
+        self.frames = 0
+        self.events = 0
+        self.bytes = 0
+        self.cpu_s = 0.0
+        self.audio_frames = 0
+        self.audio_bytes = 0
+
+    def set_subprotocol(self, subprotocol):
+        """Switch to the encoding negotiated for a (new) connection; counters keep accumulating."""
+        self.subprotocol = subprotocol
+        self.encoding = ENCODINGS.get(subprotocol, "json")
+
+    def encode(self, frame):
+        """bytes (msgpack) or str (json) ready for `ws.send()`."""
+        t0 = time.thread_time()
+        frame["v"] = PROTOCOL_VERSION
+        if self.encoding == "msgpack":
+            message = bytes((PROTOCOL_VERSION, FRAME_EVENTS)) + msgpack.packb(frame, use_bin_type = True)
+            size = len(message)
+        else:
+            message = json.dumps(frame, separators = (",", ":"))
+            size = len(message.encode())
+        self._count(frame, size, t0)
+        return message
+
+    def encode_audio(self, segment, offset, samples):
+        """Fragments of one binary audio frame for `ws.send()`; the samples are sent from `samples` itself."""
+        self.audio_frames += 1
+        self.audio_bytes += AUDIO_HEADER.size + samples.nbytes
+        header = AUDIO_HEADER.pack(PROTOCOL_VERSION, FRAME_AUDIO, segment, offset)
+        return [header, memoryview(samples.astype("<i2", copy = False)).cast("B")]
+
+    def decode(self, message):
+        """Frame dict from a received message. A legacy single-event JSON message becomes a one-event frame.
+
+        Audio frames decode to `{"audio": {"segment", "offset", "samples"}}`,
+        with `samples` an int16 view into `message`. Anything that is not a
+        frame (truncated, not an object, `events` not a list of objects)
+        raises ValueError.
+        """
+        t0 = time.thread_time()
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            if len(message) < 2:
+                raise ValueError(f"truncated frame of {len(message)} bytes")
+            if message[0] != PROTOCOL_VERSION:
+                raise ValueError(f"unsupported protocol version {message[0]}")
+            if message[1] == FRAME_AUDIO:
+                if len(message) < AUDIO_HEADER.size:
+                    raise ValueError(f"truncated audio frame of {len(message)} bytes")
+                _, _, segment, offset = AUDIO_HEADER.unpack_from(message)
+                self.audio_frames += 1
+                self.audio_bytes += len(message)
+                samples = np.frombuffer(message, dtype = "<i2", offset = AUDIO_HEADER.size)
+                return {"audio": {"segment": segment, "offset": offset, "samples": samples}}
+            if message[1] != FRAME_EVENTS:
+                raise ValueError(f"unknown frame type {message[1]}")
+            if msgpack is None:
+                raise ValueError("binary frame received but msgpack is not installed")
+            frame = msgpack.unpackb(memoryview(message)[2:], raw = False)
+            size = len(message)
+        else:
+            frame = json.loads(message)
+            size = len(message.encode())
+            if isinstance(frame, dict) and "event" in frame:
+                frame = {"events": [frame]}
+        if not isinstance(frame, dict):
+            raise ValueError(f"frame is a {type(frame).__name__}, not an object")
+        events = frame.get("events", [])
+        if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+            raise ValueError("events is not a list of objects")
+        self._count(frame, size, t0)
+        return frame
+
+    def stats(self):
+        return {
+            "encoding": self.encoding,
+            "frames": self.frames,
+            "events": self.events,
+            "bytes": self.bytes,
+            "bytes_per_event": self.bytes / self.events if self.events else 0.0,
+            "cpu_us_per_event": self.cpu_s * 1e6 / self.events if self.events else 0.0,
+            "audio_frames": self.audio_frames,
+            "audio_bytes": self.audio_bytes,
+        }
+
+    def _count(self, frame, size, t0):
+        self.cpu_s += time.thread_time() - t0
+        self.frames += 1
+        self.events += len(frame.get("events", ())) if isinstance(frame, dict) else 0
+        self.bytes += size
+
+def _compare(n_frames = 2000, batch = 16):
+    """Encode/decode a typical event mix in every available encoding and print the cost."""
+    now = time.time()
+    events = [{"event": "segment_saved", "data": {
+        "segment": i, "file": f"recordings/segment_{i}.wav", "start": now + i, "end": now + i + 1.5,
+        "duration": 1.5, "start_sample": i * 24000, "end_sample": (i + 1) * 24000}}
+        for i in range(batch)]
+    print(f"{'encoding':<10}{'bytes/event':>12}{'enc us/event':>14}{'dec us/event':>14}")
+    for subprotocol in subprotocols():
+        enc, dec = FrameCodec(subprotocol), FrameCodec(subprotocol)
+        for _ in range(n_frames):
+            dec.decode(enc.encode({"sent_at": now, "events": events}))
+        e, d = enc.stats(), dec.stats()
+        print(f"{e['encoding']:<10}{e['bytes_per_event']:>12.1f}{e['cpu_us_per_event']:>14.2f}{d['cpu_us_per_event']:>14.2f}")
+
+if __name__ == "__main__":
+    _compare()
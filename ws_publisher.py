@@ -0,0 +1,405 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import websockets
+
+from ws_protocol import FrameCodec, subprotocols
+
+# an event of the key type makes a still-unsent event of the value type with the
+# same coalescing key redundant, e.g. a segment that was already saved before
+# its speech_start went out (unless audio of that segment is still queued
+# behind the speech_start, which subscribers need to see first)
+SUPERSEDES = {
+    "segment_saved": "speech_start",
+    "stats": "stats",
+}
+
+# event type of live audio frames in the queue (sent as binary audio frames, not in event batches)
+AUDIO = "audio"
+
+# what to drop when the queue is full:
+#   drop-oldest  the oldest queued event
+#   drop-newest  the event being published
+#   priority     the oldest event not in PRIORITY_EVENTS; those only go when nothing else is left
+DROP_POLICIES = ("drop-oldest", "drop-newest", "priority")
+PRIORITY_EVENTS = {"merged", "segment_saved", "stats"}  # stats is coalesced, so at most one is queued
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of latencies in milliseconds (cheap enough for every event)."""
+
+    BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000)
+
+    def __init__(self, buckets_ms = BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        i = 0
+        while i < len(self.buckets_ms) and ms > self.buckets_ms[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        """Upper bucket bound below which a `q` fraction of observations fall."""
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets_ms + (float("inf"),), self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(bound, self.max_ms)
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+        }
+
+class EventPublisher:
+    """Sends events to a WebSocket server from an asyncio loop on a background thread.
+
+    `publish()` is thread-safe and never blocks. Queued events are packed into
+    one `{"sent_at": ..., "events": [...]}` frame per batch, encoded as
+    negotiated with the server (see ws_protocol): a batch goes
+    out `max_batch_delay` seconds after its first event, or as soon as it
+    holds `max_batch_size` events. Events superseded before they were sent
+    (see SUPERSEDES) are dropped from the batch.
+
+    At most `max_queue` events are held, so memory stays flat while the
+    server is down; `drop_policy` (see DROP_POLICIES) picks what goes when the
+    queue is full. Every `stats_interval` seconds a `stats` event with the
+    drop counts is published alongside the regular events.
+
+    `publish_audio()` queues live segment audio in the same ordered queue, so
+    a subscriber sees speech_start, the segment's audio, then segment_saved
+    (a full queue can drop any of them, per the drop policy).
+
+    Every event is numbered (`seq`) when it is taken for sending and kept in a
+    replay ring of up to `max_replay` events until the server acknowledges it.
+    After a reconnect the unacknowledged events are sent again first; the
+    server drops sequence numbers it has already seen from this publisher
+    (`X-Publisher-Id`), so consumers get each event once. Live audio is not
+    replayed. Reconnects wait a random time up to `reconnect_delay`, doubled
+    after each failed attempt up to `max_reconnect_delay` (full jitter), so
+    clients dropped by a server restart do not all come back at once.
+
+    An event published with a `trace` dict (see ws_protocol.TRACE_STAGES) is
+    stamped when it is published, dequeued and sent; events without one
+    cost nothing extra.
+    """
+
+    def __init__(self, url, max_batch_delay = 0.02, max_batch_size = 64, reconnect_delay = 0.5,
+                 max_reconnect_delay = 30.0, max_queue = 1000, drop_policy = "priority", stats_interval = 10.0,
+                 stream_id = None, max_replay = 1000):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy!r}")
+        self.url = url
+        self.stream_id = stream_id  # sent as X-Stream-Id, so a hub can route by stream
+        self.max_batch_delay = max_batch_delay
+        self.max_batch_size = max_batch_size
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_replay = max_replay
+        self.publisher_id = os.urandom(8).hex()  # scopes our sequence numbers on the server
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        self.stats_interval = stats_interval
+        self.latency = LatencyHistogram()  # enqueue -> on the wire, per event
+        self.sent_events = 0
+        self.sent_frames = 0
+        self.coalesced = 0
+        self.send_failures = 0
+        self.sent_audio_frames = 0
+        self.received = 0  # messages from the server (acks, echoes)
+        self.reconnects = 0
+        self.replayed = 0
+        self.replay_evicted = 0  # sent but unacknowledged events pushed out of a full replay ring
+        self.acked_seq = 0
+        self.codec = FrameCodec()
+        self._ack_codec = FrameCodec()  # decodes what the server sends, kept apart from the send stats
+        self.dropped = Counter()  # event type -> events dropped because the queue was full
+        self._pending = deque()  # [event_type, payload, key, enqueued_at, seq, trace]; event_type None = coalesced/dropped
+        self._unacked = deque()  # replay ring: sent (or being sent) events in seq order, touched by the loop only
+        self._seq = 0
+        self._queued = 0  # live (not coalesced/dropped) entries in _pending
+        self._by_key = {}
+        self._audio_queued = Counter()  # segment -> live audio frames of it in _pending
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "ws-publisher", daemon = True)
+        self._thread.start()
+        self._ready.wait()
+
+    def publish(self, event_type, payload, key = None, trace = None):
+        """Queue an event; `key` identifies what it refers to (e.g. the segment) for coalescing.
+
+        Returns False if the event was dropped because the queue is full.
+        """
+        if trace is not None:
+            trace["publish"] = time.monotonic()
+        entry = [event_type, payload, key, time.perf_counter(), None, trace]
+        with self._lock:
+            if key is not None:
+                stale = self._by_key.get((SUPERSEDES.get(event_type), key))
+                if stale is not None and not (stale[0] == "speech_start" and self._audio_queued[key]):
+                    del self._by_key[(stale[0], key)]
+                    stale[0] = None
+                    self._queued -= 1
+                    self.coalesced += 1
+            if self._queued >= self.max_queue and not self._make_room(event_type):
+                self.dropped[event_type] += 1
+                return False
+            if key is not None:
+                self._by_key[(event_type, key)] = entry
+            if event_type == AUDIO:
+                self._audio_queued[payload[0]] += 1
+            was_empty = not self._pending
+            self._pending.append(entry)
+            self._queued += 1
+        if was_empty:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def publish_audio(self, segment, offset, samples):
+        """Queue int16 `samples` of `segment` starting at sample `offset` within it.
+
+        The array is sent as is, so the caller must not modify it afterwards.
+        """
+        return self.publish(AUDIO, (segment, offset, samples))
+
+    def pending(self):
+        with self._lock:
+            return self._queued
+
+    def stats(self):
+        return {
+            "queue_depth": self.pending(),
+            "sent_events": self.sent_events,
+            "sent_frames": self.sent_frames,
+            "sent_audio_frames": self.sent_audio_frames,
+            "coalesced": self.coalesced,
+            "dropped": dict(self.dropped),
+            "dropped_total": sum(self.dropped.values()),
+            "send_failures": self.send_failures,
+            "received": self.received,
+            "reconnects": self.reconnects,
+            "unacked": len(self._unacked),
+            "acked_seq": self.acked_seq,
+            "replayed": self.replayed,
+            "replay_evicted": self.replay_evicted,
+            "codec": self.codec.stats(),
+            "latency": self.latency.summary(),
+        }
+
+    def stop(self, timeout = 2):
+        """Send what is still queued and wait for its acks (if connected within `timeout`), then stop."""
+        self._stopping = True
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        self._thread.join(timeout = timeout)
+
+    def _make_room(self, event_type):
+        """Drop one queued event per the drop policy (lock held); False = drop the new one instead."""
+        if self.drop_policy == "drop-newest":
+            return False
+        while self._pending[0][0] is None:
+            self._pending.popleft()  # leading tombstones, nothing refers to them any more
+        victim = None
+        if self.drop_policy == "priority":
+            victim = next((e for e in self._pending if e[0] is not None and e[0] not in PRIORITY_EVENTS), None)
+            if victim is None and event_type not in PRIORITY_EVENTS:
+                return False  # only priority events queued: the new one is the least important
+        if victim is None:
+            victim = next(e for e in self._pending if e[0] is not None)
+        self.dropped[victim[0]] += 1
+        self._unqueue(victim)
+        victim[0] = None
+        # dropped entries stay in the deque as tombstones until sent past; while
+        # nothing is being sent they pile up, so compact once they outnumber live ones
+        if len(self._pending) > 2 * self.max_queue:
+            self._pending = deque(e for e in self._pending if e[0] is not None)
+        return True
+
+    def _unqueue(self, entry):
+        """Bookkeeping for a live entry that leaves the queue, sent or dropped (lock held)."""
+        if entry[2] is not None and self._by_key.get((entry[0], entry[2])) is entry:
+            del self._by_key[(entry[0], entry[2])]
+        if entry[0] == AUDIO:
+            segment = entry[1][0]
+            self._audio_queued[segment] -= 1
+            if not self._audio_queued[segment]:
+                del self._audio_queued[segment]
+        self._queued -= 1
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _stats_loop(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.publish("stats", self.stats(), key = "publisher")
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        if self.stats_interval:
+            asyncio.get_running_loop().create_task(self._stats_loop())
+        headers = {"X-Publisher-Id": self.publisher_id}
+        if self.stream_id:
+            headers["X-Stream-Id"] = self.stream_id
+        attempt = 0
+        while not (self._stopping and not self._queued and not self._unacked):
+            try:
+                async with websockets.connect(self.url, open_timeout = 5, subprotocols = subprotocols(),
+                                              additional_headers = headers) as ws:
+                    attempt = 0
+                    self.codec.set_subprotocol(ws.subprotocol)
+                    self._ack_codec.set_subprotocol(ws.subprotocol)
+                    print(f"🌐 WebSocket connected to {self.url} ({self.codec.encoding})")
+                    # whichever ends first: the server closing (reader) or a send failing (sender)
+                    reader = asyncio.get_running_loop().create_task(self._read_loop(ws))
+                    sender = asyncio.get_running_loop().create_task(self._send_loop(ws))
+                    try:
+                        done, _ = await asyncio.wait((reader, sender), return_when = asyncio.FIRST_COMPLETED)
+                    finally:
+                        reader.cancel()
+                        sender.cancel()
+                    for task in done:
+                        task.result()  # re-raise what ended the connection
+                    if sender not in done:
+                        raise ConnectionError("closed by the server")
+            except Exception as e:
+                print("⚠️ WS connection error:", e)
+            if self._stopping:
+                return
+            # full jitter: a random wait up to an exponentially growing bound
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** attempt)
+            attempt += 1
+            self.reconnects += 1
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def _read_loop(self, ws):
+        # keep reading so server messages never pile up and stall the connection
+        async for message in ws:
+            self.received += 1
+            try:
+                frame = self._ack_codec.decode(message)
+            except ValueError:
+                continue
+            if "ack" in frame:
+                self._acked(frame["ack"])
+                self._wakeup.set()  # stop() may be waiting for the last acks
+
+    def _acked(self, seq):
+        self.acked_seq = max(self.acked_seq, seq)
+        while self._unacked and self._unacked[0][4] <= seq:
+            self._unacked.popleft()
+
+    async def _send_loop(self, ws):
+        # events the previous connection did not get acknowledged go first, in their original order
+        replay = list(self._unacked)
+        for start in range(0, len(replay), self.max_batch_size):
+            await self._send_events(ws, replay[start:start + self.max_batch_size])
+            self.replayed += len(replay[start:start + self.max_batch_size])
+        while True:
+            if not self._pending:
+                if self._stopping and not self._unacked:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # give the batch up to max_batch_delay to fill, unless it is full already
+            if len(self._pending) < self.max_batch_size and not self._stopping:
+                await asyncio.sleep(self.max_batch_delay)
+            batch = self._take_batch()
+            for entry in batch:
+                if entry[0] != AUDIO:
+                    self._track(entry)
+            events = []
+            for entry in batch:
+                if entry[0] == AUDIO:
+                    # keep the order: flush the events queued before this audio frame first
+                    if events:
+                        await self._send_events(ws, events)
+                        events = []
+                    await self._send_audio(ws, entry)
+                else:
+                    events.append(entry)
+            if events:
+                await self._send_events(ws, events)
+
+    def _track(self, entry):
+        """Number `entry` and keep it in the replay ring until acked, so a failed send is not lost."""
+        self._seq += 1
+        entry[4] = self._seq
+        self._unacked.append(entry)
+        if len(self._unacked) > self.max_replay:
+            self._unacked.popleft()
+            self.replay_evicted += 1
+
+    async def _send_events(self, ws, batch):
+        events = []
+        sent = None
+        for e in batch:
+            event = {"event": e[0], "data": e[1], "seq": e[4]}
+            if e[5] is not None:
+                sent = sent or time.monotonic()
+                e[5]["send"] = sent
+                event["trace"] = e[5]
+            events.append(event)
+        frame = self.codec.encode({"sent_at": time.time(), "events": events})
+        await self._send(ws, frame, batch)
+        self.sent_events += len(batch)
+        self.sent_frames += 1
+        if self.codec.subprotocol is None:
+            # a server that did not negotiate our protocol sends no acks; delivered to it is as good as it gets
+            self._acked(batch[-1][4])
+
+    async def _send_audio(self, ws, entry):
+        if self.codec.subprotocol is None:
+            # the server did not negotiate our protocol, it would not know what to do with audio frames
+            self.dropped[AUDIO] += 1
+            return
+        await self._send(ws, self.codec.encode_audio(*entry[1]), (entry,))
+        self.sent_audio_frames += 1
+
+    async def _send(self, ws, message, entries):
+        try:
+            await ws.send(message)
+        except Exception:
+            self.send_failures += 1
+            raise
+        now = time.perf_counter()
+        for e in entries:
+            self.latency.observe((now - e[3]) * 1000.0)
+
+    def _take_batch(self):
+        batch = []
+        now = None
+        with self._lock:
+            while self._pending and len(batch) < self.max_batch_size:
+                entry = self._pending.popleft()
+                if entry[0] is None:
+                    continue  # superseded or dropped before it was sent
+                self._unqueue(entry)
+                if entry[5] is not None:
+                    now = now or time.monotonic()
+                    entry[5]["dequeue"] = now
+                batch.append(entry)
+        return batch
\ No newline at end of file